@@ -0,0 +1,289 @@
+"""Optional async serving mode: runs server.app under an ASGI server.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+
+The event loop only moves bytes. Each request runs the unchanged Flask view
+on one of three sized thread pools, so slow yt-dlp work cannot starve the
+rest of the server:
+
+- extract: routes that call extract_info/download, and /thumb, which fetches
+           remote artwork (ASYNC_EXTRACT_WORKERS)
+- stream:  long-lived bodies, i.e. /stream and ZIP (ASYNC_STREAM_WORKERS)
+- light:   everything else, /health included (ASYNC_LIGHT_WORKERS)
+
+SSE routes (/jobs/<id>/events, /tracks/<id>/events) only run their view on
+the light pool: the view hands back a server.EventTail and the event log is
+then followed from the loop, so an open subscription holds no thread.
+
+A request whose pool has every thread busy is answered 503 right away
+instead of queueing behind them. A view that takes longer than
+ASYNC_REQUEST_TIMEOUT gets a 504, and a body
+that produces nothing for ASYNC_IDLE_TIMEOUT is cut off. When the client
+disconnects, the response iterator is closed at its next yield, which stops
+its generator (and kills ffmpeg for /stream). Threads cannot be interrupted,
+so a view that already started a download finishes it, and the file still
+lands in the track cache.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+EXTRACT_WORKERS = int(os.environ.get('ASYNC_EXTRACT_WORKERS', 8))
+STREAM_WORKERS = int(os.environ.get('ASYNC_STREAM_WORKERS', 64))
+LIGHT_WORKERS = int(os.environ.get('ASYNC_LIGHT_WORKERS', 8))
+REQUEST_TIMEOUT = float(os.environ.get('ASYNC_REQUEST_TIMEOUT', 300))
+IDLE_TIMEOUT = float(os.environ.get('ASYNC_IDLE_TIMEOUT', 60))
+
+EXTRACT_ROUTES = ('/search', '/search/batch', '/search_albums', '/album_tracks', '/download', '/download/batch')
+EXTRACT_PREFIXES = ('/thumb/',)  # Downloads remote artwork and resizes it with ffmpeg
+STREAM_PREFIXES = ('/stream/', '/album_zip/')
+
+
+class Pool(ThreadPoolExecutor):
+    """ThreadPoolExecutor that knows how many of its threads are busy"""
+
+    def __init__(self, max_workers, thread_name_prefix):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.workers = max_workers
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._busy_lock:
+            self.busy += 1
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._busy_lock:
+            self.busy -= 1
+
+    @property
+    def saturated(self):
+        return self.busy >= self.workers
+
+
+executors = {
+    'extract': Pool(EXTRACT_WORKERS, 'asgi-extract'),
+    'stream': Pool(STREAM_WORKERS, 'asgi-stream'),
+    'light': Pool(LIGHT_WORKERS, 'asgi-light'),
+}
+
+_done = object()
+
+
+def executor_for(path):
+    if path in EXTRACT_ROUTES or path.startswith(EXTRACT_PREFIXES):
+        return executors['extract']
+    if path.startswith(STREAM_PREFIXES):
+        return executors['stream']
+    return executors['light']
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    raw_path = scope.get('raw_path') or scope['path'].encode('utf-8')
+    root_path = scope.get('root_path', '').encode('utf-8')
+    if root_path and raw_path.startswith(root_path):
+        raw_path = raw_path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.decode('latin-1'),
+        'PATH_INFO': raw_path.split(b'?', 1)[0].decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_SOFTWARE': 'servermusic-asgi',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ['CONTENT_LENGTH'] = str(len(body))  # The body is already buffered, chunked or not
+    return environ
+
+
+def call_app(environ):
+    """Run the Flask app up to its headers; returns (status, headers, iterable)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+        return write
+
+    def write(data):
+        raise RuntimeError('asgi.py does not support the WSGI write() callable; return the body instead')
+
+    iterable = server.app(environ, start_response)
+    return started['status'], started['headers'], iterable
+
+
+def close_iterable(iterable):
+    close = getattr(iterable, 'close', None)
+    if close:
+        close()
+
+
+def close_when_done(future, executor, get_iterable):
+    """Close a response iterator once the thread currently using it lets go"""
+    def callback(f):
+        if f.cancelled() or f.exception() is not None:
+            return
+        iterable = get_iterable(f.result())
+        if iterable is None:
+            return
+        try:
+            executor.submit(close_iterable, iterable)
+        except RuntimeError:  # Shutting down: close it here instead
+            close_iterable(iterable)
+    future.add_done_callback(callback)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_error(send, status, message, headers=()):
+    body = json.dumps({'error': message}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_http(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+    executor = executor_for(scope['path'])
+    if executor.saturated:
+        # Queued work would only wait behind busy threads until it timed out
+        await send_error(send, 503, 'Server busy, retry later', [(b'retry-after', b'1')])
+        return
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    environ = wsgi_environ(scope, body)
+    environ['servermusic.async_sse'] = True  # SSE views return an EventTail instead of a generator
+    try:
+        view = executor.submit(call_app, environ)
+        done, _ = await asyncio.wait({asyncio.wrap_future(view), disconnected},
+                                     timeout=REQUEST_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        if not view.done():
+            # The view keeps running in its thread: release its response when it returns
+            close_when_done(view, executor, lambda result: result[2])
+            if not disconnected.done():
+                await send_error(send, 504, 'Request timed out')
+            return
+
+        try:
+            status, headers, iterable = view.result()
+        except Exception as e:
+            print(f"Error in ASGI request {scope['path']}: {e}")
+            await send_error(send, 500, str(e))
+            return
+        tail = environ.get('servermusic.sse_tail')
+        if tail is not None:
+            close_iterable(iterable)  # Empty body; the frames come from the tail
+            await stream_events(send, status, headers, tail, disconnected)
+            return
+        iterator = iter(iterable)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        try:
+            while True:
+                chunk = executor.submit(next, iterator, _done)
+                done, _ = await asyncio.wait({asyncio.wrap_future(chunk), disconnected},
+                                             timeout=IDLE_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    # Client left or the body stalled: stop the generator when it yields next
+                    close_when_done(chunk, executor, lambda _, stalled=iterable: stalled)
+                    iterable = None
+                    return
+                data = chunk.result()
+                if data is _done:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        finally:
+            if iterable is not None:
+                await asyncio.wrap_future(executor.submit(close_iterable, iterable))
+    finally:
+        disconnected.cancel()
+
+
+async def stream_events(send, status, headers, tail, disconnected):
+    """Follow an event log from the loop until its terminal event or a disconnect"""
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    try:
+        while not tail.done and not disconnected.done():
+            frames = tail.poll()  # Non-blocking reads of a small local file
+            if frames:
+                await send({'type': 'http.response.body', 'body': ''.join(frames).encode(), 'more_body': True})
+                continue
+            await asyncio.wait({disconnected}, timeout=server.SSE_POLL_INTERVAL)
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        tail.close()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def handle_lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await loop.run_in_executor(executors['light'], server.warm_ydl_pools)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for executor in executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
@@ -0,0 +1,15 @@
+"""Entry point for benchmarks: server.app with the fake YoutubeDL installed.
+
+BENCH_ASGI=1 serves it through asgi.py instead of plain WSGI.
+"""
+import os
+
+import fake_ytdlp
+
+fake_ytdlp.install()
+
+# Both must be imported after the fake is installed
+if os.environ.get('BENCH_ASGI') == '1':
+    from asgi import app  # noqa: E402,F401
+else:
+    from server import app  # noqa: E402,F401
@@ -0,0 +1,65 @@
+"""Compare two benchmark result files written by run.py.
+
+    python benchmarks/compare.py results/old.json results/new.json --threshold 10
+
+Exits with status 1 when a scenario's p95 latency or throughput regressed by
+more than --threshold percent, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def fmt(value, suffix=''):
+    return '-' if value is None else f"{value:.1f}{suffix}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed regression in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    if baseline['meta']['config'] != candidate['meta']['config']:
+        print('Warning: runs used different settings, numbers are not directly comparable')
+    print(f"baseline  {baseline['meta']['commit'][:10]}  {baseline['meta']['timestamp']}")
+    print(f"candidate {candidate['meta']['commit'][:10]}  {candidate['meta']['timestamp']}\n")
+    print(f"{'scenario':22} {'req/s':>9} {'Δ':>7}   {'p50 ms':>9} {'Δ':>7}   {'p95 ms':>9} {'Δ':>7}   "
+          f"{'p99 ms':>9} {'Δ':>7}")
+
+    regressions = []
+    for name, new in candidate['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old or 'skipped' in old or 'skipped' in new:
+            continue
+        rps = change(old['rps'], new['rps'])
+        latency = {p: change(old['latency_ms'][p], new['latency_ms'][p]) for p in ('p50', 'p95', 'p99')}
+        print(f"{name:22} {fmt(new['rps']):>9} {fmt(rps, '%'):>7}   "
+              + "   ".join(f"{fmt(new['latency_ms'][p]):>9} {fmt(latency[p], '%'):>7}"
+                           for p in ('p50', 'p95', 'p99')))
+        if (rps is not None and rps < -args.threshold) or \
+                (latency['p95'] is not None and latency['p95'] > args.threshold):
+            regressions.append(name)
+
+    old_rss, new_rss = baseline.get('peak_rss_bytes'), candidate.get('peak_rss_bytes')
+    if old_rss and new_rss:
+        print(f"\npeak RSS {new_rss / 2**20:.1f} MiB ({fmt(change(old_rss, new_rss), '%')})")
+    if regressions:
+        print(f"\nRegressed by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
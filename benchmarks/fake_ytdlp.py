@@ -0,0 +1,158 @@
+"""Deterministic local stand-in for yt_dlp.YoutubeDL used by the benchmarks.
+
+Extraction never touches the network: searches, channels and playlists are
+synthesized from the URL, with BENCH_EXTRACT_LATENCY seconds of simulated
+latency per call. Single videos point at a local media file served by the
+benchmark's HTTP server (BENCH_MEDIA_URL), so downloads, progress hooks and,
+when ffmpeg is installed, the real FFmpeg postprocessors all run as usual.
+Thumbnail URLs (i.ytimg.com) are answered with cover.png from the same
+server, so artwork fetches and /thumb stay local too.
+
+Without ffmpeg (BENCH_POSTPROCESS=0) the downloaded file is renamed to the
+profile's extension instead of being converted.
+"""
+import hashlib
+import os
+import struct
+import time
+import wave
+import zlib
+from pathlib import Path
+
+import yt_dlp
+
+EXTRACT_LATENCY = float(os.environ.get('BENCH_EXTRACT_LATENCY', 0.05))
+MEDIA_URL = os.environ.get('BENCH_MEDIA_URL', 'http://127.0.0.1:8765/media.wav')
+TRACKS_PER_ALBUM = int(os.environ.get('BENCH_TRACKS_PER_ALBUM', 8))
+POSTPROCESS = os.environ.get('BENCH_POSTPROCESS', '1') == '1'
+ARTWORK_URL = f"{MEDIA_URL.rsplit('/', 1)[0]}/cover.png"
+SAMPLE_RATE = 22050  # Mono 16-bit: 44.1 kB per second of audio
+
+
+def write_media(path, payload_kb):
+    """Write a deterministic sine-sweep WAV of roughly `payload_kb` kB"""
+    frames = max(payload_kb * 1024 // 2, SAMPLE_RATE // 10)
+    samples = bytearray()
+    for i in range(frames):
+        # Integer sawtooth sweep: cheap to generate and not trivially compressible
+        samples += struct.pack('<h', ((i * (1 + i // SAMPLE_RATE) * 97) % 40000) - 20000)
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(bytes(samples))
+    return Path(path).stat().st_size
+
+
+def write_cover(path, size=720):
+    """Write a deterministic RGB gradient PNG, so no imaging library is needed"""
+    raw = bytearray()
+    for y in range(size):
+        raw.append(0)  # Filter type of the scanline
+        for x in range(size):
+            raw += bytes((x * 255 // size, y * 255 // size, 128))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n"
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+                + chunk(b'IDAT', zlib.compress(bytes(raw), 6))
+                + chunk(b'IEND', b''))
+    return Path(path).stat().st_size
+
+
+def thumbnail_url(item_id):
+    return f"https://i.ytimg.com/vi/{item_id}/hqdefault.jpg"
+
+
+def fake_id(seed, length=11):
+    return hashlib.sha1(seed.encode()).hexdigest()[:length]
+
+
+class FakeYoutubeDL(yt_dlp.YoutubeDL):
+    def __init__(self, params=None, *args, **kwargs):
+        params = dict(params or {})
+        self.bench_codec = None
+        for pp in params.get('postprocessors', []):
+            if pp.get('key') == 'FFmpegExtractAudio':
+                self.bench_codec = pp.get('preferredcodec')
+        if not POSTPROCESS:
+            params['postprocessors'] = []
+            params['writethumbnail'] = False
+        super().__init__(params, *args, **kwargs)
+
+    def extract_info(self, url, download=True, *args, **kwargs):
+        time.sleep(EXTRACT_LATENCY)
+        if url.startswith('ytsearch'):
+            return self.search_result(url)
+        if '/channel/' in url:
+            channel_id = url.split('/channel/')[1].split('/')[0]
+            return {'_type': 'playlist', 'id': channel_id, 'title': 'Releases', 'entries': [
+                {'id': f"OLAK5uy_{fake_id(channel_id + str(i), 30)}", 'title': f"Album {i}"}
+                for i in range(6)
+            ]}
+        if 'list=' in url:
+            playlist_id = url.split('list=')[1].split('&')[0]
+            return {'_type': 'playlist', 'id': playlist_id, 'title': f"Album {playlist_id[-6:]}",
+                    'thumbnail': thumbnail_url(fake_id(playlist_id)), 'entries': [
+                        {'id': fake_id(f"{playlist_id}:{i}"), 'title': f"Track {i + 1}",
+                         'duration': 30, 'uploader': 'Bench Artist'}
+                        for i in range(TRACKS_PER_ALBUM)
+                    ]}
+        if 'watch?v=' in url:
+            return self.video_result(url.split('watch?v=')[1], download)
+        raise yt_dlp.utils.DownloadError(f"Fake YoutubeDL cannot handle {url}")
+
+    def urlopen(self, req):
+        url = req if isinstance(req, str) else req.url
+        if url.startswith('https://i.ytimg.com/'):
+            req = ARTWORK_URL
+        return super().urlopen(req)
+
+    def search_result(self, url):
+        count, _, query = url[len('ytsearch'):].partition(':')
+        count = int(count or 1)
+        entries = []
+        for i in range(count):
+            video_id = fake_id(f"{query}:{i}")
+            entries.append({
+                'id': video_id,
+                'title': f"{query} #{i + 1}",
+                'url': f"https://www.youtube.com/watch?v={video_id}",
+                'webpage_url': (f"https://www.youtube.com/playlist?list=OLAK5uy_{fake_id(query + str(i), 30)}"
+                                if 'OLAK5uy' in query else f"https://www.youtube.com/watch?v={video_id}"),
+                'duration': 30,
+                'uploader': 'Bench Artist',
+                'channel_id': f"UC{fake_id(query, 22)}",
+            })
+        return {'_type': 'playlist', 'id': query, 'title': query, 'entries': entries}
+
+    def video_result(self, video_id, download):
+        info = {
+            'id': video_id,
+            'title': f"Track {video_id}",
+            'uploader': 'Bench Artist',
+            'duration': 30,
+            'thumbnail': thumbnail_url(video_id),
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'extractor': 'fake',
+            'extractor_key': 'Fake',
+            'formats': [{
+                'format_id': 'wav',
+                'url': MEDIA_URL,
+                'ext': 'wav',
+                'acodec': 'pcm_s16le',
+                'vcodec': 'none',
+                'protocol': 'http',
+            }],
+        }
+        info = self.process_ie_result(info, download=download)
+        if download and not POSTPROCESS and self.bench_codec:
+            source = Path(info['requested_downloads'][0]['filepath'])
+            source.rename(source.with_suffix(f".{self.bench_codec}"))
+        return info
+
+
+def install():
+    yt_dlp.YoutubeDL = FakeYoutubeDL
@@ -0,0 +1,458 @@
+"""Load-test every route of server.py against a local, deterministic yt-dlp.
+
+Starts gunicorn (gunicorn.conf.py, fake YoutubeDL from fake_ytdlp.py) in a
+scratch directory, serves a generated WAV over a local HTTP server and runs
+each scenario with N concurrent keep-alive clients. Reports p50/p95/p99
+latency, requests per second and peak server RSS, and writes them as JSON
+so runs on different commits can be compared with compare.py.
+
+    python benchmarks/run.py --concurrency 8 --duration 10
+    python benchmarks/run.py --scenarios search_hit,download_miss --latency 0.2
+    python benchmarks/run.py --scenarios search_miss,download_miss --cold
+"""
+import argparse
+import functools
+import http.client
+import http.server
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+import fake_ytdlp  # noqa: E402
+
+QUERIES = [f"artist {i}" for i in range(5)]
+PRIMED_VIDEOS = [f"warm{i:07d}" for i in range(8)]
+PRIMED_ALBUM = 'OLAK5uy_bench_primed_album'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    media_latency = 0
+
+    def do_GET(self):
+        time.sleep(self.media_latency)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_media_server(directory, latency):
+    handler = functools.partial(type('MediaHandler', (QuietHandler,), {'media_latency': latency}),
+                                directory=str(directory))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', free_port()), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def process_tree(pid):
+    pids = [pid]
+    for p in pids:
+        try:
+            children = Path(f"/proc/{p}/task/{p}/children").read_text().split()
+        except OSError:
+            continue
+        pids.extend(int(c) for c in children)
+    return pids
+
+
+def tree_rss(pid):
+    """Resident memory of a process and its children in bytes (Linux only)"""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{p}/status").read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def max_child_rss():
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # kB everywhere but macOS
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self.stopped.wait(self.interval)
+
+    def reset(self):
+        self.peak = tree_rss(self.pid)
+
+
+class Server:
+    def __init__(self, args, workdir, media_url):
+        self.port = free_port()
+        self.base = f"127.0.0.1:{self.port}"
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join([str(BENCH_DIR), str(REPO_DIR)]),
+                   BENCH_MEDIA_URL=media_url,
+                   BENCH_EXTRACT_LATENCY=str(args.latency),
+                   BENCH_TRACKS_PER_ALBUM=str(args.tracks_per_album),
+                   BENCH_POSTPROCESS='1' if args.ffmpeg else '0',
+                   BENCH_ASGI='1' if args.asgi else '0',
+                   PROMETHEUS_MULTIPROC_DIR=str(workdir / 'metrics'))
+        if args.cold:
+            # Every yt-dlp call builds its own YoutubeDL, as before pooling and warming
+            env.update(YDL_POOL_SIZE='0', YDL_WARM_POOLS='0')
+        self.started = time.monotonic()
+        self.log = open(workdir / 'server.log', 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'bench_app:app', '-c', str(REPO_DIR / 'gunicorn.conf.py'),
+             '--chdir', str(workdir), '--bind', self.base, '--workers', str(args.workers),
+             '--timeout', '300']
+            + (['--worker-class', 'uvicorn.workers.UvicornWorker'] if args.asgi else []),
+            env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60):
+        """Wait for /health; returns seconds since start-up (includes pool warming)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn exited during start-up, see server.log')
+            try:
+                status, _ = request(self.base, 'GET', '/health')
+                if status == 200:
+                    return round(time.monotonic() - self.started, 3)
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError('Server did not become ready')
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def request(base, method, path, body=None, headers=None, conn=None):
+    """One request; returns (status, body bytes). Reuses `conn` when given"""
+    own = conn is None
+    conn = conn or http.client.HTTPConnection(base, timeout=300)
+    headers = dict(headers or {})
+    payload = None
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    try:
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        if own:
+            conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_load(base, make_request, concurrency, duration, max_requests, on_response=None):
+    """Hammer the server with `concurrency` keep-alive clients"""
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+    counter = itertools.count()
+    stop_at = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection(base, timeout=300)
+        try:
+            while time.monotonic() < stop_at:
+                n = next(counter)
+                if max_requests and n >= max_requests:
+                    return
+                method, path, body, headers = make_request(n)
+                started = time.perf_counter()
+                try:
+                    status, response_body = request(base, method, path, body, headers, conn)
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    conn = http.client.HTTPConnection(base, timeout=300)
+                    with lock:
+                        errors.append(repr(e))
+                    continue
+                elapsed = time.perf_counter() - started
+                if on_response:
+                    on_response(status, response_body)
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    failed = sum(count for status, count in statuses.items() if status >= 400) + len(errors)
+    return {
+        'requests': len(latencies),
+        'failed': failed,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'connection_errors': errors[:5],
+        'seconds': round(wall, 3),
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.50)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+_unique = itertools.count()
+
+
+def unique(prefix):
+    """Ids that were never requested before in this run (cache misses)"""
+    return f"{prefix}{next(_unique):010d}"
+
+
+def post(path, body):
+    return 'POST', path, body, None
+
+
+def get(path, headers=None):
+    return 'GET', path, None, headers
+
+
+def wait_for_jobs(base, job_ids, timeout=300):
+    deadline = time.monotonic() + timeout
+    for job_id in job_ids:
+        while time.monotonic() < deadline:
+            status, body = request(base, 'GET', f"/jobs/{job_id}")
+            if status != 200 or json.loads(body)['status'] in ('done', 'error'):
+                break
+            time.sleep(0.2)
+
+
+def prime(base, ffmpeg):
+    """Warm the caches the *_hit scenarios read from; returns shared fixtures"""
+    for query in QUERIES:
+        request(base, 'POST', '/search', {'query': query})
+        request(base, 'POST', '/search_albums', {'query': query})
+    request(base, 'POST', '/album_tracks', {'playlist_id': PRIMED_ALBUM})
+    for video_id in PRIMED_VIDEOS:
+        request(base, 'POST', '/download', {'video_id': video_id})
+    status, body = request(base, 'POST', '/download_album',
+                           {'playlist_id': PRIMED_ALBUM, 'album_title': 'Bench Album'})
+    job = json.loads(body)
+    wait_for_jobs(base, [job['job_id']])
+    if ffmpeg:  # Resizing needs ffmpeg
+        for video_id in PRIMED_VIDEOS:
+            request(base, 'GET', f"/thumb/{video_id}?size=320&format=jpeg")
+    return {
+        'job_id': job['job_id'],
+        'album_folder': quote(job['album_folder']),
+        'file_name': f"{PRIMED_VIDEOS[0]}.mp3-320.mp3",
+    }
+
+
+def scenarios(fixtures):
+    """name -> (make_request(n), requires ffmpeg binary)"""
+    counter = itertools.count()
+    pick = lambda items, n: items[n % len(items)]  # noqa: E731
+    return {
+        'health': (lambda n: get('/health'), False),
+        'search_hit': (lambda n: post('/search', {'query': pick(QUERIES, n)}), False),
+        'search_miss': (lambda n: post('/search', {'query': f"miss {next(counter)} {time.time()}"}), False),
+        'search_batch': (lambda n: post('/search/batch', {'queries': QUERIES + [f"batch {n} {time.time()}"]}), False),
+        'search_albums_hit': (lambda n: post('/search_albums', {'query': pick(QUERIES, n)}), False),
+        'search_albums_miss': (lambda n: post('/search_albums', {'query': f"albums {n} {time.time()}"}), False),
+        'album_tracks_hit': (lambda n: post('/album_tracks', {'playlist_id': PRIMED_ALBUM}), False),
+        'download_hit': (lambda n: post('/download', {'video_id': pick(PRIMED_VIDEOS, n)}), False),
+        'download_miss': (lambda n: post('/download', {'video_id': unique('m')}), False),
+        'download_batch_hit': (lambda n: post('/download/batch', {'video_ids': PRIMED_VIDEOS[:4]}), False),
+        'download_file': (lambda n: get(f"/download_file/{fixtures['file_name']}"), False),
+        'download_file_range': (lambda n: get(f"/download_file/{fixtures['file_name']}",
+                                              {'Range': 'bytes=1000-50999'}), False),
+        'stream_hit': (lambda n: get(f"/stream/{pick(PRIMED_VIDEOS, n)}"), False),
+        'stream_miss': (lambda n: get(f"/stream/{unique('s')}"), True),
+        'download_album': (lambda n: post('/download_album', {'playlist_id': f"OLAK5uy_{unique('a')}",
+                                                              'album_title': f"Bench {n}"}), False),
+        'job_status': (lambda n: get(f"/jobs/{fixtures['job_id']}"), False),
+        'job_events': (lambda n: get(f"/jobs/{fixtures['job_id']}/events"), False),
+        'job_retry': (lambda n: post(f"/jobs/{fixtures['job_id']}/retry", {}), False),
+        'track_events': (lambda n: get(f"/tracks/{pick(PRIMED_VIDEOS, n)}/events"), False),
+        'album_zip': (lambda n: get(f"/album_zip/{fixtures['album_folder']}"), False),
+        'thumb_hit': (lambda n: get(f"/thumb/{pick(PRIMED_VIDEOS, n)}?size=320&format=jpeg"), True),
+        # New URL each time (artwork fetch); same bytes, so the resized variant is shared
+        'thumb_miss': (lambda n: get(f"/thumb/{unique('t')}?size=320&format=jpeg"), True),
+        'library': (lambda n: get('/library?per_page=50'), False),
+        'profiles': (lambda n: get('/profiles'), False),
+        'storage': (lambda n: get('/storage'), False),
+        'cache_stats': (lambda n: get('/cache/stats'), False),
+        'scheduler': (lambda n: get('/scheduler'), False),
+        'metrics': (lambda n: get('/metrics'), False),
+    }
+
+
+def git_revision():
+    def git(*cmd):
+        try:
+            return subprocess.run(['git', *cmd], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        except OSError:
+            return ''
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--', '*.py'))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', help='Comma-separated scenario names (default: all)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per scenario')
+    parser.add_argument('--max-requests', type=int, default=0, help='Stop a scenario after this many requests')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--asgi', action='store_true', help='Serve asgi.py with uvicorn workers')
+    parser.add_argument('--cold', action='store_true',
+                        help='Disable YoutubeDL pooling and warming (YDL_POOL_SIZE=0, YDL_WARM_POOLS=0)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated yt-dlp extraction latency (s)')
+    parser.add_argument('--media-latency', type=float, default=0.0, help='Delay before serving media (s)')
+    parser.add_argument('--payload-kb', type=int, default=512, help='Size of the source media file')
+    parser.add_argument('--tracks-per-album', type=int, default=8)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<commit>-<time>.json)')
+    parser.add_argument('--list', action='store_true', help='List scenarios and exit')
+    args = parser.parse_args()
+
+    all_scenarios = scenarios({})
+    if args.list:
+        print('\n'.join(all_scenarios))
+        return
+    selected = args.scenarios.split(',') if args.scenarios else list(all_scenarios)
+    unknown = [name for name in selected if name not in all_scenarios]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    args.ffmpeg = shutil.which(os.environ.get('FFMPEG_BIN', 'ffmpeg')) is not None
+    if not args.ffmpeg:
+        print('ffmpeg not found: downloads skip transcoding and ffmpeg-only scenarios are skipped')
+
+    workdir = Path(tempfile.mkdtemp(prefix='servermusic-bench-'))
+    media_dir = workdir / 'media'
+    media_dir.mkdir()
+    media_size = fake_ytdlp.write_media(media_dir / 'media.wav', args.payload_kb)
+    fake_ytdlp.write_cover(media_dir / 'cover.png')
+    media = start_media_server(media_dir, args.media_latency)
+    server = Server(args, workdir, f"http://127.0.0.1:{media.server_address[1]}/media.wav")
+    results = {}
+    try:
+        ready_seconds = server.wait_ready()
+        print(f"Server ready in {ready_seconds}s")
+        sampler = RssSampler(server.process.pid)
+        sampler.start()
+        fixtures = prime(server.base, args.ffmpeg)
+        table = scenarios(fixtures)
+
+        for name in selected:
+            make_request, needs_ffmpeg = table[name]
+            if needs_ffmpeg and not args.ffmpeg:
+                results[name] = {'skipped': 'ffmpeg not installed'}
+                continue
+            sampler.reset()
+            job_ids = []
+            on_response = None
+            if name == 'download_album':
+                on_response = lambda status, body: status == 202 and job_ids.append(json.loads(body)['job_id'])  # noqa: E731
+            result = run_load(server.base, make_request, args.concurrency, args.duration, args.max_requests,
+                              on_response)
+            result['peak_rss_bytes'] = sampler.peak or None
+            results[name] = result
+            print(f"{name:22} {result['rps']:>9} req/s  p50 {result['latency_ms']['p50']} ms  "
+                  f"p95 {result['latency_ms']['p95']} ms  p99 {result['latency_ms']['p99']} ms  "
+                  f"failed {result['failed']}/{result['requests']}")
+            # Let queued album jobs finish so they do not slow down later scenarios
+            wait_for_jobs(server.base, job_ids)
+        sampler.stopped.set()
+        peak_rss = sampler.peak
+    finally:
+        server.stop()
+        media.shutdown()
+
+    report = {
+        'meta': {
+            **git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'ffmpeg': args.ffmpeg,
+            'config': {
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'max_requests': args.max_requests,
+                'workers': args.workers,
+                'asgi': args.asgi,
+                'cold': args.cold,
+                'latency': args.latency,
+                'media_latency': args.media_latency,
+                'payload_bytes': media_size,
+                'tracks_per_album': args.tracks_per_album,
+            },
+        },
+        'ready_seconds': ready_seconds,
+        # Without /proc, fall back to the largest single server process
+        'peak_rss_bytes': peak_rss or max_child_rss(),
+        'scenarios': results,
+    }
+    output = Path(args.output) if args.output else (
+        BENCH_DIR / 'results' / f"{report['meta']['commit'][:10] or 'nogit'}-{int(time.time())}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
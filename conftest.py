@@ -0,0 +1,15 @@
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """Import server.py inside a scratch directory so its downloads/ and state stay out of the repo"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('server'))
+    try:
+        yield importlib.import_module('server')
+    finally:
+        os.chdir(cwd)
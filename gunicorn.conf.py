@@ -0,0 +1,34 @@
+# gunicorn reads this file automatically from the working directory.
+# Command-line flags (Procfile / Dockerfile) still take precedence.
+import os
+import shutil
+import tempfile
+
+# Workers write their metrics here so /metrics can add them up
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'servermusic-metrics'))
+
+# Every route runs on gthread workers (not the default sync ones): SSE
+# subscribers hold a connection open for minutes, and threads keep them from
+# taking a whole worker each. server.SSE_MAX_SUBSCRIBERS caps them per worker
+# below `threads`; asgi.py follows SSE from its event loop instead.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    """Start each run with no metric files left over from old worker pids"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def post_worker_init(worker):
+    """Build and warm the yt-dlp pools before the worker accepts requests"""
+    import server
+    server.warm_ydl_pools()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
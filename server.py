@@ -1,9 +1,41 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, g
 from flask_cors import CORS
 import yt_dlp
 import os
+import re
 import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+import subprocess
+import queue
+import atexit
+from collections import OrderedDict, deque
+import struct
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote
+from werkzeug.http import http_date, parse_date
+from werkzeug.security import safe_join
+from yt_dlp.postprocessor.common import PostProcessor
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+try:
+    import fcntl  # Cross-process file locks (not available on Windows)
+except ImportError:
+    fcntl = None
+
+try:
+    import mutagen  # Reads durations of files found on disk
+except ImportError:
+    mutagen = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Flutter app
@@ -11,12 +43,1761 @@ CORS(app)  # Enable CORS for Flutter app
 # Configuration
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(exist_ok=True)
+TMP_DIR = DOWNLOAD_DIR / ".tmp"  # In-progress transcodes, published by rename
+TMP_DIR.mkdir(exist_ok=True)
+LOCK_DIR = DOWNLOAD_DIR / ".locks"  # One lock file per cache key
+LOCK_DIR.mkdir(exist_ok=True)
+STALE_TMP_SECONDS = 3600
+JOBS_DIR = DOWNLOAD_DIR / ".jobs"  # Album job state, readable by every worker
+JOBS_DIR.mkdir(exist_ok=True)
+JOB_TTL_SECONDS = 24 * 3600
+EVENTS_DIR = DOWNLOAD_DIR / ".events"  # Progress event logs, one per channel
+EVENTS_DIR.mkdir(exist_ok=True)
+STATE_DIR = DOWNLOAD_DIR / ".state"  # SQLite databases shared by all workers
+STATE_DIR.mkdir(exist_ok=True)
+
+# Search/playlist results cache (TTL per endpoint, LRU bounded)
+RESULT_CACHE_DB = STATE_DIR / "results.db"
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 5000))
+# Hit/miss counters and LRU touches are batched in memory and written at most this often
+RESULT_CACHE_FLUSH_SECONDS = float(os.environ.get('RESULT_CACHE_FLUSH_SECONDS', 5))
+RESULT_CACHE_TTLS = {
+    'search': int(os.environ.get('SEARCH_CACHE_TTL', 15 * 60)),
+    'search_albums': int(os.environ.get('SEARCH_ALBUMS_CACHE_TTL', 60 * 60)),
+    'album_tracks': int(os.environ.get('ALBUM_TRACKS_CACHE_TTL', 6 * 60 * 60)),
+    'artwork': 7 * 24 * 60 * 60,  # Image URL -> content hash of the downloaded artwork
+    'artwork_source': 30 * 24 * 60 * 60,  # Album playlist ID -> cover URL
+}
+
+# Index of every produced file
+LIBRARY_DB = STATE_DIR / "library.db"
+LIBRARY_MAX_PER_PAGE = 200
+CACHED_TRACK_RE = re.compile(r'^(?P<video_id>[A-Za-z0-9_-]{1,64})\.(?P<profile>[a-z0-9-]+)(?:\.stream)?\.(?P<ext>[a-z0-9]+)$')
+
+# Disk quota for DOWNLOAD_DIR (0 disables eviction)
+DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES', 0))
+DISK_QUOTA_LOW_WATERMARK = float(os.environ.get('DISK_QUOTA_LOW_WATERMARK', 0.8))
+EVICTION_INTERVAL = int(os.environ.get('EVICTION_INTERVAL', 300))
+
+# Server-Sent Events progress streams
+PROGRESS_EVENT_INTERVAL = 0.5  # Seconds between progress events of one download
+SSE_POLL_INTERVAL = 0.25
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 600))  # Clients reconnect with Last-Event-ID
+# Under gunicorn each open stream holds a worker thread: past this many per
+# worker, new subscribers get a 503 so requests like /health keep a thread.
+# asgi.py tails the logs on its event loop instead and is not limited.
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 16))
+
+# Idle yt-dlp instances kept per option set in each worker
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 4))
+YDL_WARM_POOLS = os.environ.get('YDL_WARM_POOLS', '1') != '0'  # 0: build instances on first use
+
+# Album downloads run in the background on a bounded pool
+ALBUM_WORKERS = int(os.environ.get('ALBUM_WORKERS', 4))
+TRACK_RETRIES = int(os.environ.get('TRACK_RETRIES', 2))
+
+# Output profiles (the profile name is part of the cache key).
+# mp3-<kbps> re-encodes; opus and m4a keep the original audio stream and
+# only remux it, so they cost no transcode at all.
+DEFAULT_PROFILE = os.environ.get('DEFAULT_PROFILE', 'mp3-320')
+MP3_BITRATES = [kbps.strip() for kbps in os.environ.get('MP3_BITRATES', '320,256,192,128').split(',')]
+PROFILES = {
+    f'mp3-{kbps}': {
+        'ext': 'mp3',
+        'format': 'bestaudio/best',
+        'codec': 'mp3',
+        'quality': kbps,
+        'stream_args': ['-c:a', 'libmp3lame', '-b:a', f'{kbps}k', '-f', 'mp3'],
+    }
+    for kbps in MP3_BITRATES
+}
+PROFILES['opus'] = {
+    'ext': 'opus',
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    'codec': 'opus',  # Opus in WebM is copied into an Ogg container
+    'quality': None,
+    'stream_args': ['-c:a', 'copy', '-f', 'opus'],
+}
+PROFILES['m4a'] = {
+    'ext': 'm4a',
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+    'codec': 'm4a',  # AAC is copied into an M4A container
+    'quality': None,
+    'stream_args': None,  # MP4 needs its index before the audio, so it cannot be piped
+}
+if DEFAULT_PROFILE not in PROFILES:
+    # Fail at startup rather than with a KeyError on the first request
+    raise RuntimeError(f"DEFAULT_PROFILE={DEFAULT_PROFILE!r} is not a known profile "
+                       f"(check MP3_BITRATES); available: {', '.join(PROFILES)}")
+
+# Artwork: originals stored once by content hash, resized variants next to them
+ARTWORK_DIR = DOWNLOAD_DIR / ".artwork"
+ARTWORK_DIR.mkdir(exist_ok=True)
+ARTWORK_MAX_AGE = 30 * 24 * 3600  # Unused this long (mtime is refreshed on use): deleted
+# Artwork lives outside DISK_QUOTA_BYTES, so it has its own cap (least recently used go first)
+ARTWORK_MAX_BYTES = int(os.environ.get('ARTWORK_MAX_BYTES', 256 * 1024 * 1024))
+THUMB_SIZES = (96, 160, 320, 480, 720)  # Requested sizes snap up to one of these
+THUMB_DEFAULT_SIZE = 320
+THUMB_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg', ['-q:v', '4']),
+    'webp': ('webp', 'image/webp', ['-c:v', 'libwebp', '-quality', '80']),
+}
+THUMB_CACHE_SECONDS = 30 * 24 * 3600
+
+# Scheduler: every yt-dlp extraction/download in a worker takes one slot.
+# Interactive lookups may use any slot; bulk downloads (album jobs, batch
+# downloads) never take the reserved ones and are served round-robin per client.
+SCHEDULER_SLOTS = int(os.environ.get('SCHEDULER_SLOTS', 8))
+SCHEDULER_INTERACTIVE_RESERVED = int(os.environ.get('SCHEDULER_INTERACTIVE_RESERVED', 3))
+SCHEDULER_BACKOFF_BASE = float(os.environ.get('SCHEDULER_BACKOFF_BASE', 5))
+SCHEDULER_BACKOFF_MAX = 300
+SCHEDULER_RECOVERY_SUCCESSES = 5  # Successful calls before the bulk limit grows by one
+THROTTLE_MARKERS = ('http error 429', 'too many requests', 'rate-limit', 'rate limit',
+                    "confirm you're not a bot", 'confirm you\u2019re not a bot')
+
+# Progressive streaming (/stream) pipes the source through one ffmpeg process
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+
+# Album search: playlist lookups run concurrently within a time budget
+ALBUM_LOOKUP_CONCURRENCY = int(os.environ.get('ALBUM_LOOKUP_CONCURRENCY', 6))
+ALBUM_LOOKUP_DEADLINE = float(os.environ.get('ALBUM_LOOKUP_DEADLINE', 12))
+
+# Batch endpoints run their items concurrently within one request
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_MAX_SEARCHES = 20
+BATCH_MAX_DOWNLOADS = 25
+
+# File serving
+AUDIO_MIMETYPES = {'mp3': 'audio/mpeg', 'm4a': 'audio/mp4', 'opus': 'audio/ogg'}
+MAX_RANGES = 16
+CHUNK_SIZE = 64 * 1024
+
+# Metrics. Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py)
+# lets /metrics aggregate every worker process.
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+REQUEST_DURATION = Histogram('servermusic_request_duration_seconds',
+                             'Time to build a response (excludes streaming the body)',
+                             ['endpoint', 'method'], buckets=STAGE_BUCKETS)
+REQUESTS = Counter('servermusic_requests_total', 'HTTP responses', ['endpoint', 'status'])
+ERRORS = Counter('servermusic_errors_total', 'HTTP responses with status >= 400', ['endpoint', 'status'])
+STAGE_DURATION = Histogram('servermusic_stage_duration_seconds',
+                           'Duration of extraction, download and postprocessing stages',
+                           ['stage'], buckets=STAGE_BUCKETS)
+DOWNLOADED_BYTES = Counter('servermusic_downloaded_bytes_total', 'Source bytes fetched by yt-dlp')
+SERVED_BYTES = Counter('servermusic_served_bytes_total', 'Bytes sent to clients', ['endpoint'])
+TRACK_CACHE = Counter('servermusic_track_cache_lookups_total', 'Transcoded file cache lookups', ['result'])
+INFLIGHT = Gauge('servermusic_inflight', 'Requests and jobs in progress', ['kind'],
+                 multiprocess_mode='livesum')
+SCHEDULER_QUEUED = Gauge('servermusic_scheduler_queued', 'yt-dlp calls waiting for a slot', ['priority'],
+                         multiprocess_mode='livesum')
+SCHEDULER_RUNNING = Gauge('servermusic_scheduler_running', 'yt-dlp calls holding a slot', ['priority'],
+                          multiprocess_mode='livesum')
+SCHEDULER_WAIT = Histogram('servermusic_scheduler_wait_seconds', 'Time spent waiting for a slot',
+                           ['priority'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+SCHEDULER_THROTTLES = Counter('servermusic_scheduler_throttles_total', 'Upstream throttling responses seen')
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+album_executor = ThreadPoolExecutor(max_workers=ALBUM_WORKERS, thread_name_prefix='album')
+
+def safe_filename(text):
+    """Keep only characters that are safe in a file or folder name"""
+    return "".join(c for c in text if c.isalnum() or c in (' ', '-', '_')).strip()
+
+def cached_track_name(video_id, profile):
+    """Content-addressed file name for a track in a given output profile"""
+    return f"{video_id}.{profile}.{PROFILES[profile]['ext']}"
+
+def streamed_track_name(video_id, profile):
+    """Cache name of /stream output, which has no artwork and fewer tags than a download"""
+    return f"{video_id}.{profile}.stream.{PROFILES[profile]['ext']}"
+
+def download_options(profile, outtmpl):
+    """yt-dlp options for an audio download with metadata and artwork"""
+    settings = PROFILES[profile]
+    return {
+        'format': settings['format'],
+        'postprocessors': [
+            {
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': settings['codec'],
+                'preferredquality': settings['quality'],
+            },
+            {
+                'key': 'FFmpegMetadata',
+                'add_metadata': True,
+            },
+            {
+                'key': 'EmbedThumbnail',
+                'already_have_thumbnail': False,
+            }
+        ],
+        # CachedArtworkPP supplies the thumbnail from the artwork cache
+        'writethumbnail': False,
+        'outtmpl': outtmpl,
+        'quiet': False,
+        'no_warnings': False,
+        'progress_hooks': [progress_hook],
+        'postprocessor_hooks': [postprocessor_hook],
+        'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+    }
+
+# Pooled YoutubeDL instances are shared between calls, so their hooks
+# forward to listeners registered by the thread currently using them.
+_hook_local = threading.local()
+
+def progress_hook(d):
+    print(f"Progress: {d.get('_percent_str', '0%')}")
+    for listener in list(getattr(_hook_local, 'listeners', ())):
+        listener('download', d)
+
+def postprocessor_hook(d):
+    for listener in list(getattr(_hook_local, 'listeners', ())):
+        listener('postprocess', d)
+
+@contextmanager
+def hook_listener(listener):
+    """Receive yt-dlp hook events raised by this thread while in the block"""
+    listeners = _hook_local.__dict__.setdefault('listeners', [])
+    listeners.append(listener)
+    try:
+        yield listener
+    finally:
+        listeners.remove(listener)
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+class StageTimer:
+    """Turns yt-dlp hook events into extract/download/postprocessor timings"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.extracted = False
+        self.download_started = None
+        self.postprocessors = {}
+
+    def __call__(self, kind, d):
+        now = time.perf_counter()
+        if kind == 'download':
+            if not self.extracted:
+                self.extracted = True
+                STAGE_DURATION.labels('extract').observe(now - self.started)
+            if self.download_started is None:
+                self.download_started = now
+            if d.get('status') == 'finished':
+                STAGE_DURATION.labels('download').observe(now - self.download_started)
+                DOWNLOADED_BYTES.inc(d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+                self.download_started = None
+        elif d.get('status') == 'started':
+            self.postprocessors[d['postprocessor']] = now
+        elif d.get('status') == 'finished' and d['postprocessor'] in self.postprocessors:
+            started = self.postprocessors.pop(d['postprocessor'])
+            STAGE_DURATION.labels(d['postprocessor']).observe(now - started)
+
+FLAT_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+}
+
+def ydl_options(kind):
+    """Options of a pool: 'flat', 'info:<profile>' or 'download:<profile>'"""
+    if kind == 'flat':
+        return dict(FLAT_OPTIONS)
+    name, _, profile = kind.partition(':')
+    if name == 'info':
+        return {
+            'format': PROFILES[profile]['format'],
+            'quiet': True,
+            'no_warnings': True,
+            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+        }
+    if name == 'download':
+        return download_options(profile, str(TMP_DIR / "track.%(ext)s"))
+    raise ValueError(f"Unknown yt-dlp option set: {kind}")
+
+_ydl_pools = {}
+_ydl_pools_lock = threading.Lock()
+
+@contextmanager
+def pooled_ydl(kind, outtmpl=None):
+    """Check out a reusable YoutubeDL for one thread.
+
+    Reusing instances skips option parsing, extractor set-up and keeps
+    HTTP connections alive. An instance that raised is closed rather
+    than returned, since its state is unknown.
+    """
+    with _ydl_pools_lock:
+        pool = _ydl_pools.setdefault(kind, queue.LifoQueue())
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = yt_dlp.YoutubeDL(ydl_options(kind))
+        if kind.startswith('download:'):
+            ydl.add_post_processor(CachedArtworkPP(), when='before_dl')
+    if outtmpl:
+        ydl.params['outtmpl']['default'] = outtmpl
+    
+    try:
+        yield ydl
+    except BaseException:
+        ydl.close()
+        raise
+    if pool.qsize() < YDL_POOL_SIZE:
+        pool.put(ydl)
+    else:
+        ydl.close()
+
+def warm_ydl_pools():
+    """Create the common instances before the worker takes requests"""
+    if not YDL_WARM_POOLS or not YDL_POOL_SIZE:
+        return
+    started = time.perf_counter()
+    for kind in ('flat', f'info:{DEFAULT_PROFILE}', f'download:{DEFAULT_PROFILE}'):
+        with pooled_ydl(kind) as ydl:
+            for extractor in ('Youtube', 'YoutubeTab', 'YoutubeSearch'):
+                ydl.get_info_extractor(extractor)
+    print(f"yt-dlp pools warmed in {time.perf_counter() - started:.2f}s")
+
+def ydl_pool_stats():
+    with _ydl_pools_lock:
+        return {kind: pool.qsize() for kind, pool in _ydl_pools.items()}
+
+def event_log(channel):
+    return EVENTS_DIR / f"{channel}.ndjson"
+
+def track_channel(video_id, profile):
+    return f"track-{video_id}.{profile}"
+
+def publish_event(channel, event_type, **fields):
+    """Append an event to a channel log; subscribers in any worker tail it"""
+    fields.update(type=event_type, time=time.time())
+    line = (json.dumps(fields) + "\n").encode()
+    try:
+        fd = os.open(event_log(channel), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)  # One O_APPEND write per event, so lines never interleave
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Could not publish {event_type} event on {channel}: {e}")
+
+def reset_event_log(channel):
+    """Start a fresh log; subscribers notice the new inode and start over"""
+    tmp_path = EVENTS_DIR / f".{channel}.{uuid.uuid4().hex}"
+    tmp_path.touch()
+    os.replace(tmp_path, event_log(channel))
+
+class ProgressPublisher:
+    """Forwards yt-dlp hook events to an SSE channel, throttled"""
+
+    def __init__(self, channel, **fields):
+        self.channel = channel
+        self.fields = fields
+        self.last_progress = 0
+
+    def __call__(self, kind, d):
+        if kind == 'download':
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - self.last_progress < PROGRESS_EVENT_INTERVAL:
+                return
+            self.last_progress = now
+            publish_event(self.channel, 'progress', status=d.get('status'),
+                          downloaded_bytes=d.get('downloaded_bytes'),
+                          total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                          speed=d.get('speed'), eta=d.get('eta'), **self.fields)
+        else:
+            publish_event(self.channel, 'stage', stage=d.get('postprocessor'),
+                          status=d.get('status'), **self.fields)
+
+class EventTail:
+    """Reads the new events of a channel log as SSE frames.
+
+    Event ids are "<inode>:<offset>", so a reconnecting client resumes
+    right after the last event it saw, unless the log was replaced since.
+    poll() never waits, so the log can be followed from a thread
+    (follow_events) or from an event loop (asgi.py).
+    """
+
+    def __init__(self, channel, resume_from, terminal, skip_finished=False):
+        self.path = event_log(channel)
+        self.terminal = terminal
+        self.skip_finished = skip_finished
+        inode, _, offset = (resume_from or '').partition(':')
+        self.inode = inode
+        self.offset = int(offset) if offset.isdigit() else 0
+        self.started = self.last_sent = time.monotonic()
+        self.f = None
+        self.done = False
+
+    def open(self):
+        """Open (or reopen, after reset_event_log) the log; False if it does not exist yet"""
+        if self.f is not None:
+            if os.stat(self.path).st_ino == os.fstat(self.f.fileno()).st_ino:
+                return True
+            self.f.close()
+            self.f = None
+            self.offset = 0
+        try:
+            self.f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        current_inode = str(os.fstat(self.f.fileno()).st_ino)
+        if self.inode and self.inode != current_inode:
+            self.offset = 0
+        elif self.skip_finished and not self.inode:
+            # Runs that already finished are not news: start after the last one
+            position = 0
+            for line in self.f:
+                position += len(line)
+                if line.endswith(b"\n") and json.loads(line).get('type') in self.terminal:
+                    self.offset = position
+        self.inode = current_inode
+        self.f.seek(self.offset)
+        return True
+
+    def poll(self):
+        """Frames for the events written since the last call (or a heartbeat)"""
+        frames = []
+        if self.done:
+            return frames
+        if time.monotonic() - self.started >= SSE_MAX_SECONDS:
+            self.done = True
+            return frames
+        try:
+            while self.open():
+                line = self.f.readline()
+                if not line.endswith(b"\n"):
+                    self.f.seek(self.offset)  # Partial line: re-read it once it is complete
+                    break
+                self.offset += len(line)
+                event = json.loads(line)
+                frames.append(f"id: {self.inode}:{self.offset}\nevent: {event['type']}\n"
+                              f"data: {line.decode().strip()}\n\n")
+                if event['type'] in self.terminal:
+                    self.done = True
+                    break
+        except FileNotFoundError:
+            self.done = True
+        if frames:
+            self.last_sent = time.monotonic()
+        elif not self.done and time.monotonic() - self.last_sent > SSE_HEARTBEAT_SECONDS:
+            frames.append(": keep-alive\n\n")
+            self.last_sent = time.monotonic()
+        return frames
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+def follow_events(tail):
+    """Yield SSE frames from an EventTail as the log grows, polling from this thread"""
+    try:
+        while not tail.done:
+            frames = tail.poll()
+            yield from frames
+            if not frames:
+                time.sleep(SSE_POLL_INTERVAL)
+    finally:
+        tail.close()
+
+def sse_response(frames):
+    return Response(frames, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Stop proxies from buffering the stream
+    })
+
+_sse_subscribers = threading.BoundedSemaphore(SSE_MAX_SUBSCRIBERS)
+
+def sse_follow(channel, resume_from, terminal, skip_finished=False):
+    """SSE response that follows a channel log until a terminal event"""
+    tail = EventTail(channel, resume_from, terminal, skip_finished)
+    if request.environ.get('servermusic.async_sse'):
+        # asgi.py streams the frames from its event loop once the view returns
+        request.environ['servermusic.sse_tail'] = tail
+        return sse_response(iter(()))
+    if not _sse_subscribers.acquire(blocking=False):
+        response = jsonify({'error': 'Too many event subscribers, retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    response = sse_response(follow_events(tail))
+    # Released when the server closes the response, even if it was never iterated
+    response.call_on_close(_sse_subscribers.release)
+    return response
+
+_inflight_lock = threading.Lock()
+_inflight = {}  # cache key -> [lock, number of waiting threads]
+
+@contextmanager
+def single_flight(key, blocking=True):
+    """Hold the lock for a cache key, across threads and gunicorn workers.
+
+    Yields True once the lock is held. With blocking=False it yields False
+    instead of waiting when someone else is already working on the key.
+    """
+    with _inflight_lock:
+        entry = _inflight.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    acquired = entry[0].acquire(blocking)
+    try:
+        if not acquired:
+            yield False
+            return
+        lock_path = LOCK_DIR / f"{key}.lock"
+        while True:
+            lock_file = open(lock_path, 'a')
+            if not fcntl:
+                break
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                lock_file.close()
+                yield False
+                return
+            # remove_lock() may have unlinked the file while we waited: lock the new one instead
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        with lock_file:
+            yield True
+    finally:
+        if acquired:
+            entry[0].release()
+        with _inflight_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight[key]
+
+def remove_lock(key):
+    """Delete the lock file of a cache key unless someone is holding it"""
+    lock_path = LOCK_DIR / f"{key}.lock"
+    try:
+        with open(lock_path, 'rb') as lock_file:
+            if fcntl and not try_lock_exclusive(lock_file):
+                return False
+            lock_path.unlink()
+            return True
+    except FileNotFoundError:
+        return True
+
+def cleanup_stale_locks():
+    """Remove lock files nobody has used for a while"""
+    cutoff = time.time() - STALE_TMP_SECONDS
+    for entry in LOCK_DIR.glob('*.lock'):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                remove_lock(entry.name[:-len('.lock')])
+        except OSError:
+            continue
+
+class Scheduler:
+    """Priority admission for yt-dlp work within one worker process.
+
+    Waiting interactive calls are always admitted first. Bulk calls are
+    limited to the non-reserved slots, alternate between clients, and
+    shrink their limit (AIMD) and pause when the upstream throttles us.
+    """
+
+    def __init__(self, slots, interactive_reserved):
+        self.slots = slots
+        self.bulk_max = max(1, slots - interactive_reserved)
+        self.bulk_limit = self.bulk_max
+        self.cond = threading.Condition()
+        self.running = {'interactive': 0, 'bulk': 0}
+        self.interactive_queue = deque()
+        self.bulk_queues = OrderedDict()  # client -> waiting tickets, in round-robin order
+        self.backoff_level = 0
+        self.backoff_until = 0
+        self.successes = 0
+        self.throttles = 0
+        self.waits = {priority: {'count': 0, 'total': 0.0, 'max': 0.0} for priority in self.running}
+
+    def acquire(self, priority, client=None):
+        ticket = {'priority': priority, 'client': client or 'anonymous', 'granted': False}
+        started = time.monotonic()
+        SCHEDULER_QUEUED.labels(priority).inc()
+        with self.cond:
+            if priority == 'interactive':
+                self.interactive_queue.append(ticket)
+            else:
+                self.bulk_queues.setdefault(ticket['client'], deque()).append(ticket)
+            self.dispatch()
+            while not ticket['granted']:
+                # During a pause, wake up when it ends: releases then may grant nothing (and notify no one)
+                self.cond.wait(self.backoff_remaining() or None)
+                self.dispatch()
+            waited = time.monotonic() - started
+            stats = self.waits[priority]
+            stats['count'] += 1
+            stats['total'] += waited
+            stats['max'] = max(stats['max'], waited)
+        SCHEDULER_QUEUED.labels(priority).dec()
+        SCHEDULER_RUNNING.labels(priority).inc()
+        SCHEDULER_WAIT.labels(priority).observe(waited)
+        return ticket
+
+    def release(self, ticket):
+        SCHEDULER_RUNNING.labels(ticket['priority']).dec()
+        with self.cond:
+            self.running[ticket['priority']] -= 1
+            self.dispatch()
+
+    def backoff_remaining(self):
+        return max(0, self.backoff_until - time.monotonic())
+
+    def dispatch(self):
+        """Hand free slots to waiters; the caller holds self.cond"""
+        granted = False
+        while sum(self.running.values()) < self.slots:
+            if self.interactive_queue:
+                ticket = self.interactive_queue.popleft()
+            elif self.bulk_queues and self.running['bulk'] < self.bulk_limit and not self.backoff_remaining():
+                client, tickets = next(iter(self.bulk_queues.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    self.bulk_queues.move_to_end(client)  # Next client's turn
+                else:
+                    del self.bulk_queues[client]
+            else:
+                break
+            ticket['granted'] = True
+            self.running[ticket['priority']] += 1
+            granted = True
+        if granted:
+            self.cond.notify_all()
+
+    def throttled(self):
+        """Upstream rate-limited a call: halve bulk concurrency and pause it"""
+        SCHEDULER_THROTTLES.inc()
+        with self.cond:
+            self.throttles += 1
+            self.successes = 0
+            self.bulk_limit = max(1, self.bulk_limit // 2)
+            self.backoff_level += 1
+            pause = min(SCHEDULER_BACKOFF_BASE * 2 ** (self.backoff_level - 1), SCHEDULER_BACKOFF_MAX)
+            self.backoff_until = max(self.backoff_until, time.monotonic() + pause)
+            # Waiters that went to sleep without a timeout must start timing the pause,
+            # or nothing wakes them once it ends
+            self.cond.notify_all()
+            print(f"Upstream throttling: bulk limit {self.bulk_limit}, pausing bulk work for {pause:.0f}s")
+
+    def succeeded(self):
+        with self.cond:
+            self.successes += 1
+            if self.successes >= SCHEDULER_RECOVERY_SUCCESSES:
+                self.successes = 0
+                self.backoff_level = max(0, self.backoff_level - 1)
+                if self.bulk_limit < self.bulk_max:
+                    self.bulk_limit += 1
+                    self.dispatch()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'pid': os.getpid(),
+                'slots': self.slots,
+                'running': dict(self.running),
+                'queued': {
+                    'interactive': len(self.interactive_queue),
+                    'bulk': sum(len(tickets) for tickets in self.bulk_queues.values()),
+                },
+                'bulk_queued_by_client': {client: len(tickets) for client, tickets in self.bulk_queues.items()},
+                'bulk_limit': self.bulk_limit,
+                'bulk_max': self.bulk_max,
+                'backoff_seconds': round(self.backoff_remaining(), 1),
+                'throttles': self.throttles,
+                'wait_seconds': {
+                    priority: {
+                        'count': w['count'],
+                        'avg': round(w['total'] / w['count'], 3) if w['count'] else 0,
+                        'max': round(w['max'], 3),
+                    }
+                    for priority, w in self.waits.items()
+                },
+            }
+
+scheduler = Scheduler(SCHEDULER_SLOTS, SCHEDULER_INTERACTIVE_RESERVED)
+
+def is_throttled(error):
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+@contextmanager
+def scheduler_slot(priority, client=None):
+    """Hold a scheduler slot, whatever happens inside"""
+    ticket = scheduler.acquire(priority, client)
+    try:
+        yield
+    finally:
+        scheduler.release(ticket)
+
+@contextmanager
+def throttle_feedback():
+    """Report the outcome of one upstream call to the scheduler"""
+    try:
+        yield
+    except Exception as e:
+        if is_throttled(e):
+            scheduler.throttled()
+        raise
+    else:
+        scheduler.succeeded()
+
+@contextmanager
+def scheduled(priority, client=None):
+    """Hold a scheduler slot around one yt-dlp call"""
+    with scheduler_slot(priority, client), throttle_feedback():
+        yield
+
+def fetch_track(video_id, profile=DEFAULT_PROFILE, priority='interactive', client=None):
+    """Return (path, cached) for a track, transcoding it at most once.
+
+    Concurrent callers for the same video and profile wait for the single
+    in-progress job. The file is built in a private temp directory and
+    only renamed into DOWNLOAD_DIR once it is complete.
+
+    Only the caller that runs yt-dlp holds a scheduler slot. It takes the
+    slot before the per-track lock, so a bulk download waiting out a
+    throttling pause never holds the lock; callers that find the track in
+    flight give their slot back and wait for the lock without one.
+    """
+    output_path = DOWNLOAD_DIR / cached_track_name(video_id, profile)
+    waited = False
+    while True:
+        if output_path.exists():
+            TRACK_CACHE.labels('coalesced' if waited else 'hit').inc()
+            return output_path, True
+
+        with scheduler_slot(priority, client), single_flight(output_path.name, blocking=False) as owner:
+            if owner:
+                if output_path.exists():  # Finished just before we took the lock
+                    waited = True
+                    continue
+                transcode_track(video_id, profile, output_path)
+                return output_path, False
+
+        # Someone else is producing it: wait for them without a slot, then check again
+        # (if they failed, the next waiter to get here retries)
+        waited = True
+        with single_flight(output_path.name):
+            pass
+
+def transcode_track(video_id, profile, output_path):
+    """Download and convert one track into output_path; the caller holds its lock and a slot"""
+    TRACK_CACHE.labels('miss').inc()
+    channel = track_channel(video_id, profile)
+    reset_event_log(channel)
+    publish_event(channel, 'started', video_id=video_id, profile=profile)
+    work_dir = TMP_DIR / uuid.uuid4().hex
+    work_dir.mkdir(parents=True)
+    INFLIGHT.labels('transcode').inc()
+    try:
+        with throttle_feedback(), \
+                pooled_ydl(f"download:{profile}", outtmpl=str(work_dir / "track.%(ext)s")) as ydl, \
+                hook_listener(StageTimer()), hook_listener(ProgressPublisher(channel, video_id=video_id)), \
+                timed('total_transcode'):
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+
+        produced = work_dir / f"track.{PROFILES[profile]['ext']}"
+        if not produced.exists():
+            raise RuntimeError('Download failed')
+        os.replace(produced, output_path)
+        library_record(output_path, video_id=video_id, profile=profile,
+                       title=info.get('title'), duration=info.get('duration'))
+        request_eviction()
+        publish_event(channel, 'done', video_id=video_id, file_path=output_path.name,
+                      file_size=output_path.stat().st_size)
+    except Exception as e:
+        publish_event(channel, 'failed', video_id=video_id, error=str(e))
+        raise
+    finally:
+        INFLIGHT.labels('transcode').dec()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+_db_local = threading.local()
+
+RESULT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+CREATE TABLE IF NOT EXISTS result_stats (
+    endpoint TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+def open_db(path, schema):
+    """Per-thread SQLite connection (WAL, so worker processes can share it)"""
+    connections = _db_local.__dict__.setdefault('connections', {})
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(schema)
+        connections[path] = conn
+    return conn
+
+@contextmanager
+def transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive cache key for free-text queries"""
+    return ' '.join(query.casefold().split())
+
+_result_pending_lock = threading.Lock()
+_result_pending = {'lookups': {}, 'touched': {}, 'flushed_at': time.time()}
+
+def count_result_lookup(endpoint, column, key=None, now=None):
+    """Count a lookup (and LRU touch) in memory, flushing when the batch is due"""
+    now = now or time.time()
+    with _result_pending_lock:
+        counters = _result_pending['lookups'].setdefault(endpoint, {'hits': 0, 'misses': 0})
+        counters[column] += 1
+        if key:
+            _result_pending['touched'][key] = now
+        due = now - _result_pending['flushed_at'] >= RESULT_CACHE_FLUSH_SECONDS
+    if due:
+        flush_result_stats()
+
+def flush_result_stats():
+    """Write pending counters and last_access updates in one transaction"""
+    with _result_pending_lock:
+        lookups, touched = _result_pending['lookups'], _result_pending['touched']
+        _result_pending.update(lookups={}, touched={}, flushed_at=time.time())
+    if not lookups and not touched:
+        return
+    try:
+        conn = open_db(RESULT_CACHE_DB, RESULT_CACHE_SCHEMA)
+        with transaction(conn):
+            conn.executemany(
+                'INSERT INTO result_stats (endpoint, hits, misses) VALUES (?, ?, ?) '
+                'ON CONFLICT (endpoint) DO UPDATE SET '
+                'hits = hits + excluded.hits, misses = misses + excluded.misses',
+                [(endpoint, c['hits'], c['misses']) for endpoint, c in lookups.items()])
+            conn.executemany(
+                'UPDATE results SET last_access = MAX(last_access, ?) WHERE key = ?',
+                [(accessed, key) for key, accessed in touched.items()])
+    except sqlite3.Error as e:
+        print(f"Could not flush result cache stats: {e}")
+
+atexit.register(flush_result_stats)
+
+def result_cache_get(endpoint, key):
+    """Return a cached result, or None on a miss (or if the cache is unavailable)"""
+    try:
+        conn = open_db(RESULT_CACHE_DB, RESULT_CACHE_SCHEMA)
+        now = time.time()
+        row = conn.execute(
+            'SELECT value FROM results WHERE key = ? AND expires_at > ?',
+            (f"{endpoint}:{key}", now)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Result cache unavailable: {e}")
+        return None
+    if row is None:
+        count_result_lookup(endpoint, 'misses', now=now)
+        return None
+    count_result_lookup(endpoint, 'hits', f"{endpoint}:{key}", now)
+    return json.loads(row[0])
+
+def result_cache_put(endpoint, key, value):
+    """Store a result with the endpoint's TTL, evicting least recently used entries"""
+    try:
+        conn = open_db(RESULT_CACHE_DB, RESULT_CACHE_SCHEMA)
+        now = time.time()
+        with transaction(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                (f"{endpoint}:{key}", endpoint, json.dumps(value),
+                 now + RESULT_CACHE_TTLS[endpoint], now))
+            conn.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                ' SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (RESULT_CACHE_MAX_ENTRIES,))
+    except sqlite3.Error as e:
+        print(f"Result cache unavailable: {e}")
+
+def cached_result(endpoint, key, compute):
+    """Return (value, hit); empty results are not cached"""
+    value = result_cache_get(endpoint, key)
+    if value is not None:
+        return value, True
+    value = compute()
+    if value:
+        result_cache_put(endpoint, key, value)
+    return value, False
+
+def result_cache_stats():
+    flush_result_stats()
+    conn = open_db(RESULT_CACHE_DB, RESULT_CACHE_SCHEMA)
+    stats = {endpoint: {'hits': 0, 'misses': 0, 'entries': 0} for endpoint in RESULT_CACHE_TTLS}
+    for endpoint, hits, misses in conn.execute('SELECT endpoint, hits, misses FROM result_stats'):
+        stats.setdefault(endpoint, {'entries': 0}).update(hits=hits, misses=misses)
+    for endpoint, entries in conn.execute(
+            'SELECT endpoint, COUNT(*) FROM results WHERE expires_at > ? GROUP BY endpoint',
+            (time.time(),)):
+        stats.setdefault(endpoint, {'hits': 0, 'misses': 0})['entries'] = entries
+    for counters in stats.values():
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    video_id TEXT,
+    playlist_id TEXT,
+    profile TEXT,
+    title TEXT,
+    size INTEGER NOT NULL,
+    duration REAL,
+    mtime_ns INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_accessed REAL
+);
+CREATE INDEX IF NOT EXISTS tracks_video_id ON tracks (video_id);
+CREATE INDEX IF NOT EXISTS tracks_playlist_id ON tracks (playlist_id);
+CREATE INDEX IF NOT EXISTS tracks_last_accessed ON tracks (last_accessed);
+CREATE TABLE IF NOT EXISTS scanned_dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+LIBRARY_COLUMNS = ('path', 'video_id', 'playlist_id', 'profile', 'title', 'size',
+                   'duration', 'mtime_ns', 'created_at', 'last_accessed')
+
+def library_path(file_path):
+    """Path of a file relative to DOWNLOAD_DIR, as used by /download_file"""
+    return Path(file_path).relative_to(DOWNLOAD_DIR).as_posix()
+
+def probe_duration(file_path):
+    if mutagen is None:
+        return None
+    try:
+        audio = mutagen.File(file_path)
+        return round(audio.info.length, 3) if audio else None
+    except Exception:
+        return None
+
+def library_record(file_path, video_id=None, playlist_id=None, profile=None, title=None, duration=None):
+    """Add or refresh the index entry of a produced file"""
+    try:
+        stat = os.stat(file_path)
+        if duration is None:
+            duration = probe_duration(file_path)
+        conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+        conn.execute(
+            'INSERT INTO tracks (path, video_id, playlist_id, profile, title, size, duration,'
+            ' mtime_ns, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (path) DO UPDATE SET'
+            ' video_id = COALESCE(excluded.video_id, video_id),'
+            ' playlist_id = COALESCE(excluded.playlist_id, playlist_id),'
+            ' profile = COALESCE(excluded.profile, profile),'
+            ' title = COALESCE(excluded.title, title),'
+            ' duration = COALESCE(excluded.duration, duration),'
+            ' size = excluded.size, mtime_ns = excluded.mtime_ns',
+            (library_path(file_path), video_id, playlist_id, profile, title,
+             stat.st_size, duration, stat.st_mtime_ns, time.time()))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Library index update failed for {file_path}: {e}")
+
+def library_touch(file_path):
+    """Record that a file was served"""
+    try:
+        conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+        conn.execute('UPDATE tracks SET last_accessed = ? WHERE path = ?',
+                     (time.time(), library_path(file_path)))
+    except sqlite3.Error as e:
+        print(f"Library index update failed for {file_path}: {e}")
+
+def library_remove(file_path):
+    try:
+        conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+        conn.execute('DELETE FROM tracks WHERE path = ?', (library_path(file_path),))
+    except sqlite3.Error as e:
+        print(f"Library index update failed for {file_path}: {e}")
+
+def sync_library():
+    """Bring the index up to date with DOWNLOAD_DIR.
+
+    Only folders whose mtime changed since the last sync are listed again:
+    files are published by rename, so any added or removed file changes the
+    mtime of its folder. New files take their video id and profile from the
+    cache file name, or from the cache file they are hard-linked to.
+    """
+    conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+    known_dirs = {path: mtime for path, mtime in conn.execute('SELECT path, mtime_ns FROM scanned_dirs')}
+    children = {}
+    for path, parent in conn.execute('SELECT path, parent FROM scanned_dirs'):
+        children.setdefault(parent, []).append(path)
+    indexed_by_dir = {}
+    for path, size, mtime in conn.execute('SELECT path, size, mtime_ns FROM tracks'):
+        indexed_by_dir.setdefault(path.rpartition('/')[0], {})[path] = (size, mtime)
+    by_inode = {}
+    added = removed = 0
+
+    def identify(entry, stat):
+        match = CACHED_TRACK_RE.match(entry.name)
+        if match and match['profile'] in PROFILES:
+            return match['video_id'], match['profile']
+        return by_inode.get((stat.st_dev, stat.st_ino), (None, None))
+
+    pending = ['']
+    while pending:
+        rel_dir = pending.pop(0)
+        directory = DOWNLOAD_DIR / rel_dir
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if known_dirs.get(rel_dir) == dir_mtime:
+            pending.extend(children.get(rel_dir, []))
+            continue
+
+        indexed = indexed_by_dir.get(rel_dir, {})
+        subdirs = []
+        present = set()
+        # Top-level cache files first, so album hard links can be identified
+        for entry in sorted(os.scandir(directory), key=lambda e: not CACHED_TRACK_RE.match(e.name)):
+            if entry.name.startswith('.'):
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(rel_path)
+                continue
+            if not entry.is_file(follow_symlinks=False) or Path(entry.name).suffix.lstrip('.') not in AUDIO_MIMETYPES:
+                continue
+            stat = entry.stat()
+            present.add(rel_path)
+            video_id, profile = identify(entry, stat)
+            if video_id and not rel_dir:
+                by_inode[(stat.st_dev, stat.st_ino)] = (video_id, profile)
+            if indexed.get(rel_path) != (stat.st_size, stat.st_mtime_ns):
+                library_record(entry.path, video_id=video_id, profile=profile,
+                               title=None if video_id and not rel_dir else Path(entry.name).stem)
+                added += 1
+
+        with transaction(conn):
+            for rel_path in set(indexed) - present:
+                conn.execute('DELETE FROM tracks WHERE path = ?', (rel_path,))
+                removed += 1
+            for gone in set(children.get(rel_dir, [])) - set(subdirs):
+                prefix = f"{gone}/"
+                conn.execute('DELETE FROM scanned_dirs WHERE path = ? OR substr(path, 1, ?) = ?',
+                             (gone, len(prefix), prefix))
+                removed += conn.execute('DELETE FROM tracks WHERE substr(path, 1, ?) = ?',
+                                        (len(prefix), prefix)).rowcount
+            conn.execute('INSERT OR REPLACE INTO scanned_dirs VALUES (?, ?, ?)',
+                         (rel_dir, None if not rel_dir else rel_dir.rpartition('/')[0], dir_mtime))
+        pending.extend(subdirs)
+
+    if added or removed:
+        print(f"Library index synced: {added} added/updated, {removed} removed")
+
+def sync_library_in_background():
+    def run():
+        try:
+            sync_library()
+        except Exception as e:
+            print(f"Library sync failed: {e}")
+    threading.Thread(target=run, name='library-sync', daemon=True).start()
+
+class ResultCacheCollector:
+    """Exports the result cache counters, which SQLite already shares across workers"""
+
+    def collect(self):
+        lookups = CounterMetricFamily('servermusic_result_cache_lookups', 'Result cache lookups',
+                                      labels=['endpoint', 'result'])
+        ratio = GaugeMetricFamily('servermusic_result_cache_hit_ratio', 'Result cache hit ratio',
+                                  labels=['endpoint'])
+        entries = GaugeMetricFamily('servermusic_result_cache_entries', 'Live result cache entries',
+                                    labels=['endpoint'])
+        try:
+            stats = result_cache_stats()
+        except sqlite3.Error:
+            stats = {}
+        for endpoint, counters in stats.items():
+            lookups.add_metric([endpoint, 'hit'], counters['hits'])
+            lookups.add_metric([endpoint, 'miss'], counters['misses'])
+            ratio.add_metric([endpoint], counters['hit_ratio'])
+            entries.add_metric([endpoint], counters['entries'])
+        yield from (lookups, ratio, entries)
+
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    REGISTRY.register(ResultCacheCollector())
+
+def load_album_tracks(playlist_id, priority='interactive', client=None):
+    """Flat track list of a playlist (cached)"""
+    def extract():
+        with scheduled(priority, client), pooled_ydl('flat') as ydl, timed('playlist_extract'):
+            playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
+            playlist_info = ydl.extract_info(playlist_url, download=False)
+        
+        thumbnails = playlist_info.get('thumbnails') or [{}]
+        remember_artwork_source(playlist_id, playlist_info.get('thumbnail') or thumbnails[-1].get('url'))
+        tracks = []
+        for entry in playlist_info.get('entries', []):
+            if entry:
+                tracks.append({
+                    'id': entry.get('id', ''),
+                    'title': entry.get('title', ''),
+                    'url': entry.get('url', f"https://www.youtube.com/watch?v={entry.get('id', '')}"),
+                    'thumbnail': entry.get('thumbnail', ''),
+                    'thumb_url': f"/thumb/{entry.get('id', '')}",
+                    'duration': entry.get('duration', 0),
+                    'author': entry.get('uploader', ''),
+                })
+        return tracks
+
+    return cached_result('album_tracks', playlist_id.strip(), extract)
+
+def artwork_key(url):
+    return hashlib.sha1(url.encode()).hexdigest()
+
+def remember_artwork_source(item_id, url):
+    """Record the cover URL of an album so /thumb and album downloads can use it"""
+    if url:
+        result_cache_put('artwork_source', item_id, url)
+
+def artwork_source(item_id):
+    """Cover URL for an album playlist or a video ID, or None"""
+    url = result_cache_get('artwork_source', item_id)
+    if url:
+        return url
+    if len(item_id) == 11:  # Video IDs have predictable thumbnail URLs
+        return f"https://i.ytimg.com/vi/{item_id}/hqdefault.jpg"
+    return None
+
+def image_extension(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return 'jpg'
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return 'png'
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return 'webp'
+    raise ValueError('Artwork is not a JPEG, PNG or WebP image')
+
+def fetch_artwork(url, ydl=None):
+    """Path of the cached original for an image URL, downloading it once.
+
+    Originals are named by the SHA-256 of their bytes, so every track of an
+    album (and every URL serving the same cover) shares one file.
+    """
+    def download():
+        if ydl is not None:
+            return ydl.urlopen(url).read()
+        with pooled_ydl('flat') as pooled:
+            return pooled.urlopen(url).read()
+
+    def compute():
+        with timed('artwork_fetch'):
+            data = download()
+        name = f"{hashlib.sha256(data).hexdigest()}.{image_extension(data)}"
+        path = ARTWORK_DIR / name
+        if not path.exists():
+            tmp_path = ARTWORK_DIR / f".{uuid.uuid4().hex}"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return {'file': name}
+
+    with single_flight(f"artwork-{artwork_key(url)}"):
+        value, _ = cached_result('artwork', url, compute)
+        path = ARTWORK_DIR / value['file']
+        if not touch_artwork(path):  # Pruned since it was indexed
+            value = compute()
+            result_cache_put('artwork', url, value)
+            path = ARTWORK_DIR / value['file']
+            request_eviction()
+        return path
+
+def touch_artwork(path):
+    """Mark cached artwork as used so prune_artwork keeps it; False if it is gone"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def thumbnail_variant(original, size, image_format):
+    """Resized copy of a cached original, made once per size and format"""
+    ext, _, codec_args = THUMB_FORMATS[image_format]
+    path = ARTWORK_DIR / f"{original.stem}.{size}.{ext}"
+    if touch_artwork(path):
+        return path
+    with single_flight(f"thumb-{path.name}"):
+        if touch_artwork(path):
+            return path
+        tmp_path = ARTWORK_DIR / f".{uuid.uuid4().hex}.{ext}"
+        command = [FFMPEG_BIN, '-v', 'error', '-y', '-i', str(original),
+                   '-vf', f"scale='min({size},iw)':-2", '-frames:v', '1', *codec_args, str(tmp_path)]
+        try:
+            with timed('thumb_resize'):
+                subprocess.run(command, check=True, capture_output=True, timeout=30)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    request_eviction()
+    return path
+
+class CachedArtworkPP(PostProcessor):
+    """Hands EmbedThumbnail a copy of the cached artwork instead of downloading it.
+
+    Always the video's own thumbnail: the file is shared by /download and
+    every album that contains the track, so it must not depend on the caller.
+    Thumbnail URLs differ per video, so this saves a fetch only when the same
+    video is converted again (another profile, or after eviction).
+    """
+
+    def run(self, info):
+        url = info.get('thumbnail')
+        if not url and info.get('thumbnails'):
+            url = info['thumbnails'][-1].get('url')
+        if not url:
+            return [], info
+        try:
+            original = fetch_artwork(url, self._downloader)
+            cover = Path(self._downloader.params['outtmpl']['default']).parent / f"cover{original.suffix}"
+            shutil.copyfile(original, cover)
+        except Exception as e:  # Including artwork pruned right after the fetch
+            self.report_warning(f"Could not fetch artwork: {e}")
+            return [], info
+        info['thumbnails'] = [{'id': 'cached', 'url': url, 'filepath': str(cover)}]
+        return [], info
+
+def prune_artwork():
+    """Keep the artwork cache bounded; anything deleted is fetched again on demand.
+
+    Drops files unused for ARTWORK_MAX_AGE, then the least recently used
+    ones until the directory is back under ARTWORK_MAX_BYTES.
+    """
+    cutoff = time.time() - ARTWORK_MAX_AGE
+    entries = []
+    for entry in os.scandir(ARTWORK_DIR):
+        try:
+            stat = entry.stat()
+            if entry.name.startswith('.') and stat.st_mtime >= time.time() - STALE_TMP_SECONDS:
+                continue  # A download or resize in progress
+            if stat.st_mtime < cutoff or entry.name.startswith('.'):
+                os.unlink(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            continue
+    usage = sum(size for _, size, _ in entries)
+    if not ARTWORK_MAX_BYTES or usage <= ARTWORK_MAX_BYTES:
+        return
+    target = ARTWORK_MAX_BYTES * DISK_QUOTA_LOW_WATERMARK
+    for _, size, path in sorted(entries):
+        if usage <= target:
+            break
+        try:
+            os.unlink(path)
+            usage -= size
+        except OSError:
+            continue
+
+def stream_command(info, profile):
+    """ffmpeg command that transcodes the source URL of `info` to stdout"""
+    codec_args = PROFILES[profile]['stream_args']
+    if codec_args[:2] == ['-c:a', 'copy'] and info.get('acodec') != PROFILES[profile]['codec']:
+        # No source in the target codec (e.g. no Opus format): encode instead
+        codec_args = ['-c:a', 'libopus', '-b:a', '160k', '-f', 'opus']
+    headers = ''.join(f"{key}: {value}\r\n" for key, value in (info.get('http_headers') or {}).items())
+    command = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin']
+    if info['url'].startswith('http'):
+        command += ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    if headers:
+        command += ['-headers', headers]
+    command += [
+        '-i', info['url'],
+        '-vn', '-map_metadata', '-1',
+        '-metadata', f"title={info.get('title') or ''}",
+        '-metadata', f"artist={info.get('uploader') or info.get('channel') or ''}",
+        *codec_args, 'pipe:1',
+    ]
+    return command
+
+def stream_track(info, profile, output_path):
+    """Yield encoded audio as ffmpeg produces it.
+
+    When no other request is producing the same file, the stream is also
+    written to a temp file and published under its own cache name (see
+    streamed_track_name) once ffmpeg exits cleanly, so later /stream
+    requests can serve it. /download never picks it up.
+    """
+    with single_flight(output_path.name, blocking=False) as owner:
+        work_dir = None
+        cache_file = None
+        if owner:
+            work_dir = TMP_DIR / uuid.uuid4().hex
+            work_dir.mkdir(parents=True)
+            cache_file = open(work_dir / output_path.name, 'wb')
+        
+        started = time.perf_counter()
+        first_byte = True
+        proc = subprocess.Popen(stream_command(info, profile), stdout=subprocess.PIPE)
+        INFLIGHT.labels('stream').inc()
+        try:
+            while True:
+                chunk = proc.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first_byte:
+                    first_byte = False
+                    STAGE_DURATION.labels('stream_first_byte').observe(time.perf_counter() - started)
+                if cache_file:
+                    cache_file.write(chunk)
+                SERVED_BYTES.labels('/stream/<video_id>').inc(len(chunk))
+                yield chunk
+            
+            returncode = proc.wait()
+            STAGE_DURATION.labels('stream_transcode').observe(time.perf_counter() - started)
+            if returncode != 0:
+                print(f"ffmpeg exited with {returncode} while streaming {info.get('id')}")
+            elif cache_file:
+                cache_file.close()
+                os.replace(work_dir / output_path.name, output_path)
+                library_record(output_path, video_id=info.get('id'), profile=profile,
+                               title=info.get('title'), duration=info.get('duration'))
+                request_eviction()
+        finally:
+            # Also runs when the client disconnects (the generator is closed)
+            INFLIGHT.labels('stream').dec()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            if cache_file:
+                cache_file.close()
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+def lock_shared(f):
+    """Mark an open file as in use so the evictor leaves it alone"""
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_SH)
+
+def try_lock_exclusive(f):
+    if not fcntl:
+        return True
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def disk_usage():
+    """Files in DOWNLOAD_DIR grouped by inode (album tracks are hard links)"""
+    groups = {}
+    for root, dirs, files in os.walk(DOWNLOAD_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            path = Path(root) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            group = groups.setdefault((stat.st_dev, stat.st_ino), {
+                'size': stat.st_size, 'mtime': stat.st_mtime, 'paths': []})
+            group['paths'].append(path)
+    return list(groups.values())
+
+def evict_group(group):
+    """Delete every link of one file unless any of them is being served"""
+    f = None
+    try:
+        # All links share the inode, so one lock covers readers of any of them
+        f = open(group['paths'][0], 'rb')
+        if not try_lock_exclusive(f):
+            return False
+        for path in group['paths']:
+            path.unlink()
+            library_remove(path)
+            if path.parent == DOWNLOAD_DIR:
+                remove_lock(path.name)
+            if path.parent != DOWNLOAD_DIR:
+                try:
+                    path.parent.rmdir()  # Only succeeds once the album folder is empty
+                except OSError:
+                    pass
+        return True
+    except OSError as e:
+        print(f"Could not evict {group['paths'][0]}: {e}")
+        return False
+    finally:
+        if f:
+            f.close()
+
+def evict_downloads():
+    """Delete least recently served files until usage is under the low watermark"""
+    if not DISK_QUOTA_BYTES:
+        return 0
+    groups = disk_usage()
+    usage = sum(group['size'] for group in groups)
+    if usage <= DISK_QUOTA_BYTES:
+        return 0
+
+    conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+    last_access = {path: accessed for path, accessed in conn.execute(
+        'SELECT path, COALESCE(last_accessed, created_at) FROM tracks')}
+    for group in groups:
+        group['accessed'] = max(last_access.get(library_path(path), group['mtime'])
+                                for path in group['paths'])
+
+    target = DISK_QUOTA_BYTES * DISK_QUOTA_LOW_WATERMARK
+    freed = 0
+    for group in sorted(groups, key=lambda g: g['accessed']):
+        if usage - freed <= target:
+            break
+        if evict_group(group):
+            freed += group['size']
+    print(f"Evicted {freed} bytes, usage now {usage - freed} of {DISK_QUOTA_BYTES}")
+    return freed
+
+_eviction_wanted = threading.Event()
+
+def request_eviction():
+    """Ask the evictor to check the quotas now (after a new file is published)"""
+    if DISK_QUOTA_BYTES or ARTWORK_MAX_BYTES:
+        _eviction_wanted.set()
+
+def run_evictor():
+    while True:
+        _eviction_wanted.wait(EVICTION_INTERVAL)
+        _eviction_wanted.clear()
+        try:
+            # One evictor at a time across gunicorn workers
+            with single_flight('evictor', blocking=False) as owner:
+                if owner:
+                    evict_downloads()
+                    prune_artwork()
+        except Exception as e:
+            print(f"Eviction failed: {e}")
+
+def start_evictor():
+    if DISK_QUOTA_BYTES or ARTWORK_MAX_BYTES:
+        threading.Thread(target=run_evictor, name='evictor', daemon=True).start()
+        request_eviction()
+
+def cleanup_stale_tmp():
+    """Remove temp directories left behind by crashed workers"""
+    cutoff = time.time() - STALE_TMP_SECONDS
+    for entry in TMP_DIR.iterdir():
+        try:
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry, ignore_errors=True)
+        except OSError:
+            continue
+
+cleanup_stale_tmp()
+cleanup_stale_locks()
+
+def job_path(job_id):
+    return JOBS_DIR / f"{job_id}.json"
+
+def read_job(job_id):
+    """Load an album job, or None if it does not exist"""
+    try:
+        with open(job_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_job(job):
+    job['updated_at'] = time.time()
+    tmp_path = JOBS_DIR / f"{job['id']}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, job_path(job['id']))
+
+def update_job(job_id, change):
+    """Apply change(job) under the job lock so workers never lose updates"""
+    with single_flight(f"job-{job_id}"):
+        job = read_job(job_id)
+        before_status = job['status']
+        before_tracks = {t['index']: t['state'] for t in job['tracks']}
+        change(job)
+        refresh_job_status(job)
+        write_job(job)
+        publish_job_changes(job, before_status, before_tracks)
+        return job
+
+def publish_job_changes(job, before_status, before_tracks):
+    channel = f"job-{job['id']}"
+    for track in job['tracks']:
+        if before_tracks.get(track['index']) != track['state']:
+            publish_event(channel, 'track', track=track['index'], video_id=track['video_id'],
+                          title=track['title'], state=track['state'], attempts=track['attempts'],
+                          error=track['error'], file_path=track['file_path'])
+    if job['status'] != before_status:
+        publish_event(channel, f"job_{job['status']}", status=job['status'],
+                      total_tracks=job['total_tracks'], completed=job.get('completed', 0),
+                      failed=job.get('failed', 0), error=job.get('error'))
+
+def refresh_job_status(job):
+    if job['status'] in ('resolving', 'error'):
+        return
+    states = [track['state'] for track in job['tracks']]
+    job['completed'] = states.count('done')
+    job['failed'] = states.count('failed')
+    if any(state in ('pending', 'downloading') for state in states):
+        job['status'] = 'running'
+    else:
+        job['status'] = 'done'
+    job['downloaded_files'] = [
+        {
+            'title': track['title'],
+            'file_path': track['file_path'],
+            'progress': f"{track['index']}/{job['total_tracks']}",
+        }
+        for track in job['tracks'] if track['state'] == 'done'
+    ]
+
+def worker_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def link_into_album(source, destination):
+    """Place a cached track in an album folder without copying when possible"""
+    try:
+        if os.path.samefile(source, destination):
+            return
+    except FileNotFoundError:
+        pass
+    # The evictor removes album folders once they are empty, even while a job is still running
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # Anything else under this name is stale: replace it rather than record the wrong file
+    tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, destination)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def run_album_job(job_id):
+    """Resolve the playlist of a job and queue one task per track"""
+    job = read_job(job_id)
+    try:
+        album_tracks, _ = load_album_tracks(job['playlist_id'], 'bulk', job.get('client'))
+    except Exception as e:
+        print(f"Error resolving album {job['playlist_id']}: {e}")
+        def mark_error(job):
+            job['status'] = 'error'
+            job['error'] = str(e)
+        update_job(job_id, mark_error)
+        return
+
+    tracks = []
+    for idx, entry in enumerate(album_tracks, 1):
+        if VIDEO_ID_RE.match(entry['id']):
+            tracks.append({
+                'index': idx,
+                'video_id': entry['id'],
+                'title': entry['title'] or f'Track {idx}',
+                'duration': entry['duration'],
+                'state': 'pending',
+                'attempts': 0,
+                'error': None,
+                'file_path': None,
+                'worker_pid': os.getpid(),
+            })
+
+    def add_tracks(job):
+        job['status'] = 'running'
+        job['tracks'] = tracks
+        job['total_tracks'] = len(album_tracks)
+    update_job(job_id, add_tracks)
+
+    for track in tracks:
+        album_executor.submit(run_album_track, job_id, track['index'])
+
+@INFLIGHT.labels('album_track').track_inprogress()
+def run_album_track(job_id, index):
+    """Download one album track, retrying it on its own if it fails"""
+    job = read_job(job_id)
+    track = next(t for t in job['tracks'] if t['index'] == index)
+    safe_title = safe_filename(track['title']) or f"Track {index}"
+    profile = job['profile']
+
+    for attempt in range(1, TRACK_RETRIES + 2):
+        def mark_downloading(job):
+            t = next(t for t in job['tracks'] if t['index'] == index)
+            t['state'] = 'downloading'
+            t['attempts'] += 1
+            t['worker_pid'] = os.getpid()
+        update_job(job_id, mark_downloading)
+
+        try:
+            with hook_listener(ProgressPublisher(f"job-{job_id}", track=index, video_id=track['video_id'])):
+                cached_path, _ = fetch_track(track['video_id'], profile, 'bulk', job.get('client'))
+            file_name = f"{index:02d} - {safe_title}.{PROFILES[profile]['ext']}"
+            album_path = DOWNLOAD_DIR / job['album_folder'] / file_name
+            link_into_album(cached_path, album_path)
+            library_record(album_path, video_id=track['video_id'], playlist_id=job['playlist_id'],
+                           profile=profile, title=track['title'], duration=track.get('duration'))
+
+            def mark_done(job):
+                t = next(t for t in job['tracks'] if t['index'] == index)
+                t['state'] = 'done'
+                t['error'] = None
+                t['file_path'] = f"{job['album_folder']}/{file_name}"
+            update_job(job_id, mark_done)
+            return
+        except Exception as e:
+            print(f"Error downloading {track['title']} (attempt {attempt}): {e}")
+            error = str(e)
+
+        if attempt <= TRACK_RETRIES:
+            time.sleep(2 ** attempt)
+
+    def mark_failed(job):
+        t = next(t for t in job['tracks'] if t['index'] == index)
+        t['state'] = 'failed'
+        t['error'] = error
+    update_job(job_id, mark_failed)
+
+def cleanup_old_jobs():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for entry in JOBS_DIR.glob('*.json'):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                entry.unlink()
+                (LOCK_DIR / f"job-{entry.stem}.lock").unlink(missing_ok=True)
+        except OSError:
+            continue
+    for entry in EVENTS_DIR.iterdir():
+        try:
+            if entry.stat().st_mtime < cutoff:
+                entry.unlink()
+        except OSError:
+            continue
+
+cleanup_old_jobs()
+prune_artwork()
+sync_library_in_background()
+start_evictor()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    INFLIGHT.labels('request').inc()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_DURATION.labels(endpoint, request.method).observe(time.perf_counter() - g.request_started)
+    REQUESTS.labels(endpoint, response.status_code).inc()
+    if response.status_code >= 400:
+        ERRORS.labels(endpoint, response.status_code).inc()
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    if 'request_started' in g:
+        INFLIGHT.labels('request').dec()
+
+def client_id():
+    """Who is asking, for fair bulk queueing: X-Client-ID, else the client address"""
+    return request.headers.get('X-Client-ID') or (request.access_route or ['anonymous'])[0]
 
 @app.route('/')
 def index():
     """Root endpoint"""
     return jsonify({'message': 'YouTube Download API', 'status': 'running'})
 
+def search_tracks(query):
+    """Top ten videos for a query, through the result cache. Returns (videos, hit)"""
+    def extract():
+        with scheduled('interactive'), pooled_ydl('flat') as ydl, timed('search_extract'):
+            search_results = ydl.extract_info(f"ytsearch10:{query}", download=False)
+        
+        videos = []
+        for entry in search_results.get('entries', []):
+            video_id = entry.get('id', '')
+            video_url = entry.get('webpage_url', f"https://www.youtube.com/watch?v={video_id}")
+            
+            print(f"DEBUG - Video ID: {video_id}, URL: {video_url}")
+            
+            videos.append({
+                'id': video_id,
+                'title': entry.get('title', ''),
+                'url': video_url,
+                'thumbnail': entry.get('thumbnail', ''),
+                'thumb_url': f"/thumb/{video_id}",
+                'duration': entry.get('duration', 0),
+                'author': entry.get('uploader', ''),
+            })
+        return videos
+    
+    return cached_result('search', normalize_query(query), extract)
+
+def run_batch(items, key, work):
+    """Run work(item) for each distinct key(item) with bounded concurrency.
+
+    Returns one result dict per item, in order; duplicates share a result and
+    a failing item only fails its own entry.
+    """
+    unique = {}
+    for item in items:
+        unique.setdefault(key(item), item)
+    
+    def run(item):
+        try:
+            return {'success': True, **work(item)}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    results = {}
+    if unique:
+        with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(unique)),
+                                thread_name_prefix='batch') as executor:
+            futures = {k: executor.submit(run, item) for k, item in unique.items()}
+        results = {k: future.result() for k, future in futures.items()}
+    return [dict(results[key(item)]) for item in items]
+
+def batch_summary(results):
+    succeeded = sum(1 for result in results if result['success'])
+    return {'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded}
+
 @app.route('/search', methods=['POST'])
 def search_videos():
     """Search YouTube videos"""
@@ -27,33 +1808,36 @@ def search_videos():
         if not query:
             return jsonify({'error': 'Query is required'}), 400
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-        }
+        videos, hit = search_tracks(query)
+        response = jsonify({'results': videos})
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search/batch', methods=['POST'])
+def search_videos_batch():
+    """Search several queries at once; each entry succeeds or fails on its own"""
+    try:
+        data = request.json
+        queries = data.get('queries')
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(f"ytsearch10:{query}", download=False)
-            
-            videos = []
-            for entry in search_results.get('entries', []):
-                video_id = entry.get('id', '')
-                video_url = entry.get('webpage_url', f"https://www.youtube.com/watch?v={video_id}")
-                
-                print(f"DEBUG - Video ID: {video_id}, URL: {video_url}")
-                
-                videos.append({
-                    'id': video_id,
-                    'title': entry.get('title', ''),
-                    'url': video_url,
-                    'thumbnail': entry.get('thumbnail', ''),
-                    'duration': entry.get('duration', 0),
-                    'author': entry.get('uploader', ''),
-                })
-            
-            return jsonify({'results': videos})
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'queries must be a non-empty list'}), 400
+        if len(queries) > BATCH_MAX_SEARCHES:
+            return jsonify({'error': f"At most {BATCH_MAX_SEARCHES} queries per batch"}), 400
+        
+        def search(query):
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError('Query is required')
+            videos, hit = search_tracks(query)
+            return {'results': videos, 'cached': hit}
+        
+        results = run_batch(queries, lambda q: normalize_query(q) if isinstance(q, str) else repr(q), search)
+        for query, result in zip(queries, results):
+            result['query'] = query
+        return jsonify(batch_summary(results))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -64,87 +1848,603 @@ def download_video():
     try:
         data = request.json
         video_id = data.get('video_id', '')
-        title = data.get('title', 'audio')
+        profile = data.get('profile', DEFAULT_PROFILE)
         
         if not video_id:
             return jsonify({'error': 'Video ID is required'}), 400
+        if not VIDEO_ID_RE.match(video_id):
+            return jsonify({'error': 'Invalid video ID'}), 400
+        if profile not in PROFILES:
+            return jsonify({'error': f"Unknown profile: {profile}"}), 400
         
-        # Sanitize filename
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-        output_path = DOWNLOAD_DIR / f"{safe_title}.mp3"
-        
-        # yt-dlp options for MP3 download with metadata and artwork
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [
-                {
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '320',
-                },
-                {
-                    'key': 'FFmpegMetadata',
-                    'add_metadata': True,
-                },
-                {
-                    'key': 'EmbedThumbnail',
-                    'already_have_thumbnail': False,
-                }
-            ],
-            'writethumbnail': True,  # Download thumbnail
-            'outtmpl': str(DOWNLOAD_DIR / f"{safe_title}.%(ext)s"),
-            'quiet': False,
-            'no_warnings': False,
-            'progress_hooks': [lambda d: print(f"Progress: {d.get('_percent_str', '0%')}")],
-            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+        # Reuses the cached file when this video was already transcoded
+        output_path, cached = fetch_track(video_id, profile)
+        
+        return jsonify({
+            'success': True,
+            'file_path': output_path.name,  # Return only filename
+            'file_size': output_path.stat().st_size,
+            'cached': cached,
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/download/batch', methods=['POST'])
+def download_video_batch():
+    """Download several videos at once; each entry succeeds or fails on its own"""
+    try:
+        data = request.json
+        video_ids = data.get('video_ids')
+        profile = data.get('profile', DEFAULT_PROFILE)
+        
+        if not isinstance(video_ids, list) or not video_ids:
+            return jsonify({'error': 'video_ids must be a non-empty list'}), 400
+        if len(video_ids) > BATCH_MAX_DOWNLOADS:
+            return jsonify({'error': f"At most {BATCH_MAX_DOWNLOADS} videos per batch"}), 400
+        if profile not in PROFILES:
+            return jsonify({'error': f"Unknown profile: {profile}"}), 400
+        
+        client = client_id()
+        
+        def download(video_id):
+            if not isinstance(video_id, str) or not VIDEO_ID_RE.match(video_id):
+                raise ValueError('Invalid video ID')
+            output_path, cached = fetch_track(video_id, profile, 'bulk', client)
+            return {
+                'file_path': output_path.name,
+                'file_size': output_path.stat().st_size,
+                'cached': cached,
+            }
+        
+        results = run_batch(video_ids, repr, download)
+        for video_id, result in zip(video_ids, results):
+            result['video_id'] = video_id
+        return jsonify(batch_summary(results))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def file_etag(stat):
+    """Strong ETag from the file identity; published files are never rewritten in place"""
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def parse_byte_ranges(header, size):
+    """Parse a Range header into inclusive (start, end) pairs.
+
+    Returns None when the header should be ignored (malformed, not bytes, too
+    many ranges) and an empty list when no range is satisfiable.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    parts = spec.split(',')
+    if len(parts) > MAX_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        first, sep, last = part.strip().partition('-')
+        if not sep or not (first or last) or not (first or '0').isdigit() or not (last or '0').isdigit():
+            return None
+        if not first:  # Suffix range: the last N bytes
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+def not_modified(etag, stat):
+    """Evaluate If-None-Match / If-Modified-Since for a GET"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and int(stat.st_mtime) <= since.timestamp()
+
+def range_applies(etag, stat):
+    """If-Range: only honour Range when the client's copy is still current"""
+    header = request.headers.get('If-Range')
+    if not header:
+        return True
+    if header.startswith('"'):
+        return header.strip('"') == etag
+    since = parse_date(header)
+    return since is not None and int(stat.st_mtime) == since.timestamp()
+
+def read_chunks(f, length):
+    """Yield at most `length` bytes from the current position of a file"""
+    while length > 0:
+        chunk = f.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+def file_chunks(f, length):
+    try:
+        yield from read_chunks(f, length)
+    finally:
+        f.close()
+
+def file_body(f, start, length, size):
+    """Body for one byte range, letting the server sendfile() it when possible"""
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # gunicorn stops at Content-Length; other wrappers may read to EOF
+    bounded = (start + length == size
+               or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'))
+    if file_wrapper and bounded:
+        return file_wrapper(f, CHUNK_SIZE)
+    return file_chunks(f, length)
+
+def multipart_body(f, parts):
+    try:
+        for header, start, length in parts:
+            yield header
+            f.seek(start)
+            yield from read_chunks(f, length)
+            yield b"\r\n"
+    finally:
+        f.close()
+
+def serve_file(file_path, download_name, mimetype):
+    """Serve a file with ETag/conditional GET, single and multi-range support"""
+    f = open(file_path, 'rb')
+    try:
+        lock_shared(f)  # Held until the response closes the file
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = file_etag(stat)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Last-Modified': http_date(stat.st_mtime),
+            'Accept-Ranges': 'bytes',
+            'Content-Disposition': f'attachment; filename="{download_name}"',
         }
+
+        if not_modified(etag, stat):
+            f.close()
+            return Response(status=304, headers=headers)
+
+        ranges = None
+        if 'Range' in request.headers and range_applies(etag, stat):
+            ranges = parse_byte_ranges(request.headers['Range'], size)
+
+        if ranges == []:
+            f.close()
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+        if not ranges:
+            SERVED_BYTES.labels(endpoint).inc(size)
+            headers['Content-Length'] = str(size)
+            return Response(file_body(f, 0, size, size), status=200, headers=headers,
+                            mimetype=mimetype, direct_passthrough=True)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+            headers['Content-Length'] = str(end - start + 1)
+            SERVED_BYTES.labels(endpoint).inc(end - start + 1)
+            return Response(file_body(f, start, end - start + 1, size), status=206,
+                            headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        total = 0
+        for start, end in ranges:
+            part_header = (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                           f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+            parts.append((part_header, start, end - start + 1))
+            total += len(part_header) + (end - start + 1) + 2
+        closing = f"--{boundary}--\r\n".encode()
+        headers['Content-Length'] = str(total + len(closing))
+        SERVED_BYTES.labels(endpoint).inc(total + len(closing))
+
+        def body():
+            yield from multipart_body(f, parts)
+            yield closing
+
+        return Response(body(), status=206, headers=headers,
+                        content_type=f"multipart/byteranges; boundary={boundary}",
+                        direct_passthrough=True)
+    except Exception:
+        f.close()
+        raise
+
+# Album ZIP export: store mode, so every offset is known before reading a byte
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_DATA_DESCRIPTOR = struct.Struct('<IIII')
+ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP_END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP_FLAGS = 0x0808  # CRC in a trailing data descriptor, UTF-8 names
+ZIP_MAX_SIZE = 0xFFFFFFFF  # No ZIP64: plain offsets are 32-bit
+
+_crc_cache = {}
+_crc_cache_lock = threading.Lock()
+
+def dos_datetime(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # DOS dates start in 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+class ZipMember:
+    """One stored file of an album ZIP; its CRC is computed only when needed"""
+
+    def __init__(self, name, f, offset):
+        self.name = name.encode('utf-8')
+        self.f = f
+        self.stat = os.fstat(f.fileno())
+        self.size = self.stat.st_size
+        self.offset = offset
+        self._crc = None
+        self.dos_time, self.dos_date = dos_datetime(self.stat.st_mtime)
+        self.key = (self.stat.st_dev, self.stat.st_ino, self.size, self.stat.st_mtime_ns)
+        self.header = ZIP_LOCAL_HEADER.pack(0x04034b50, 20, ZIP_FLAGS, 0, self.dos_time, self.dos_date,
+                                            0, self.size, self.size, len(self.name), 0) + self.name
+        self.data_offset = offset + len(self.header)
+        self.end = self.data_offset + self.size + ZIP_DATA_DESCRIPTOR.size
+
+    @property
+    def crc(self):
+        if self._crc is None:
+            with _crc_cache_lock:
+                self._crc = _crc_cache.get(self.key)
+        if self._crc is None:
+            for _ in self.read(0, self.size):  # Sets self._crc when it finishes
+                pass
+        return self._crc
+
+    def read(self, start, end):
+        """File bytes [start, end), computing the CRC on a full read"""
+        crc = 0
+        position = start
+        while position < end:
+            chunk = os.pread(self.f.fileno(), min(CHUNK_SIZE, end - position), position)
+            if not chunk:
+                raise IOError(f"{self.f.name} shrank while being zipped")
+            if start == 0:
+                crc = zlib.crc32(chunk, crc)
+            position += len(chunk)
+            yield chunk
+        if start == 0 and end == self.size:
+            self._crc = crc
+            with _crc_cache_lock:
+                if len(_crc_cache) > 10000:
+                    _crc_cache.clear()
+                _crc_cache[self.key] = crc
+
+    def descriptor(self):
+        return ZIP_DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self):
+        return ZIP_CENTRAL_HEADER.pack(0x02014b50, (3 << 8) | 20, 20, ZIP_FLAGS, 0,
+                                       self.dos_time, self.dos_date, self.crc, self.size, self.size,
+                                       len(self.name), 0, 0, 0, 0, 0o100644 << 16, self.offset) + self.name
+
+class AlbumZip:
+    """Byte-addressable layout of a store-mode ZIP built from open files"""
+
+    def __init__(self, prefix, files):
+        self.members = []
+        offset = 0
+        for name, f in files:
+            member = ZipMember(f"{prefix}/{name}", f, offset)
+            self.members.append(member)
+            offset = member.end
+        self.central_offset = offset
+        self.central_size = sum(ZIP_CENTRAL_HEADER.size + len(m.name) for m in self.members)
+        self.size = self.central_offset + self.central_size + ZIP_END_RECORD.size
+
+    @property
+    def etag(self):
+        parts = [f"{m.name.hex()}:{m.key[1]:x}:{m.size:x}:{m.key[3]:x}" for m in self.members]
+        return f"zip-{zlib.crc32(';'.join(parts).encode()):08x}-{self.size:x}"
+
+    def segments(self):
+        """(offset, length, producer) for every part of the archive, in order"""
+        for m in self.members:
+            yield m.offset, len(m.header), lambda lo, hi, m=m: [m.header[lo:hi]]
+            yield m.data_offset, m.size, m.read
+            yield m.data_offset + m.size, ZIP_DATA_DESCRIPTOR.size, lambda lo, hi, m=m: [m.descriptor()[lo:hi]]
+        yield self.central_offset, self.size - self.central_offset, self.central_directory
+
+    def central_directory(self, lo, hi):
+        records = b"".join(m.central_header() for m in self.members)
+        records += ZIP_END_RECORD.pack(0x06054b50, 0, 0, len(self.members), len(self.members),
+                                       self.central_size, self.central_offset, 0)
+        return [records[lo:hi]]
+
+    def chunks(self, start, length):
+        """Yield archive bytes [start, start + length)"""
+        end = start + length
+        try:
+            for offset, size, producer in self.segments():
+                if offset + size <= start or size == 0:
+                    continue
+                if offset >= end:
+                    break
+                yield from producer(max(start, offset) - offset, min(end, offset + size) - offset)
+        finally:
+            self.close()
+
+    def close(self):
+        for m in self.members:
+            m.f.close()
+
+@app.route('/stream/<video_id>', methods=['GET'])
+def stream_video(video_id):
+    """Stream a track while it is being transcoded (play while downloading)"""
+    try:
+        profile = request.args.get('profile', DEFAULT_PROFILE)
         
-        # Download
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+        if not VIDEO_ID_RE.match(video_id):
+            return jsonify({'error': 'Invalid video ID'}), 400
+        if profile not in PROFILES:
+            return jsonify({'error': f"Unknown profile: {profile}"}), 400
         
-        # Check if file exists
-        if output_path.exists():
-            return jsonify({
-                'success': True,
-                'file_path': f"{safe_title}.mp3",  # Return only filename
-                'file_size': output_path.stat().st_size
-            })
-        else:
-            return jsonify({'error': 'Download failed'}), 500
+        # Already transcoded (a full download, or an earlier stream): serve it with Range support
+        for name in (cached_track_name(video_id, profile), streamed_track_name(video_id, profile)):
+            cached_path = DOWNLOAD_DIR / name
+            if cached_path.exists():
+                response = serve_file(cached_path, cached_path.name, AUDIO_MIMETYPES[PROFILES[profile]['ext']])
+                response.headers['X-Cache'] = 'HIT'
+                library_touch(cached_path)
+                return response
+        
+        if not PROFILES[profile]['stream_args']:
+            return jsonify({'error': f"Profile {profile} cannot be streamed, use /download"}), 400
+        
+        headers = {'Cache-Control': 'no-store', 'X-Cache': 'MISS'}
+        mimetype = AUDIO_MIMETYPES[PROFILES[profile]['ext']]
+        if request.method == 'HEAD':
+            return Response(status=200, headers=headers, mimetype=mimetype)
+        
+        with scheduled('interactive'), pooled_ydl(f"info:{profile}") as ydl, timed('stream_extract'):
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        
+        output_path = DOWNLOAD_DIR / streamed_track_name(video_id, profile)
+        return Response(stream_track(info, profile, output_path), headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/download_file/<path:filename>', methods=['GET'])
 def download_file(filename):
-    """Serve downloaded MP3 file with streaming"""
-    try:
-        file_path = DOWNLOAD_DIR / filename
-        if file_path.exists():
-            def generate():
-                with open(file_path, 'rb') as f:
-                    while True:
-                        chunk = f.read(8192)  # Read in 8KB chunks
-                        if not chunk:
-                            break
-                        yield chunk
-            
-            from flask import Response
-            return Response(
-                generate(),
-                mimetype='audio/mpeg',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{filename}"',
-                    'Content-Length': str(file_path.stat().st_size)
-                }
-            )
+    """Serve downloaded MP3 file with Range, conditional GET and sendfile"""
+    try:
+        safe_path = safe_join(str(DOWNLOAD_DIR), filename)
+        # Temp files, locks and job state are not downloadable
+        if safe_path is None or any(part.startswith('.') for part in Path(filename).parts):
+            return jsonify({'error': 'File not found'}), 404
+        
+        file_path = Path(safe_path)
+        if file_path.is_file():
+            mimetype = AUDIO_MIMETYPES.get(file_path.suffix.lstrip('.'), 'application/octet-stream')
+            response = serve_file(file_path, file_path.name, mimetype)
+            library_touch(file_path)
+            return response
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         print(f"Error serving file: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/album_zip/<path:album_folder>', methods=['GET'])
+def download_album_zip(album_folder):
+    """Stream an album folder as an uncompressed ZIP with Range resume"""
+    try:
+        safe_path = safe_join(str(DOWNLOAD_DIR), album_folder)
+        parts = Path(album_folder).parts
+        # Only a direct album folder: not the downloads root (".") nor anything nested or hidden
+        if safe_path is None or len(parts) != 1 or parts[0].startswith('.') \
+                or not Path(safe_path).is_dir() \
+                or Path(safe_path).resolve().parent != DOWNLOAD_DIR.resolve():
+            return jsonify({'error': 'Album not found'}), 404
+        
+        folder = Path(safe_path)
+        files = []
+        try:
+            for entry in sorted(folder.iterdir()):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    f = open(entry, 'rb')
+                except FileNotFoundError:  # Evicted while listing
+                    continue
+                lock_shared(f)  # Held until the response closes the archive
+                files.append((entry.name, f))
+            archive = AlbumZip(folder.name, files)
+        except Exception:
+            for _, f in files:
+                f.close()
+            raise
+        
+        if not archive.members:
+            archive.close()
+            return jsonify({'error': 'Album has no downloaded tracks yet'}), 404
+        if archive.size > ZIP_MAX_SIZE:
+            archive.close()
+            return jsonify({'error': 'Album is too large for a ZIP export'}), 413
+        
+        # The newest track decides Last-Modified and date-based revalidation
+        newest = max((m.stat for m in archive.members), key=lambda st: st.st_mtime)
+        etag = archive.etag
+        zip_name = f"{folder.name}.zip"
+        headers = {
+            'ETag': f'"{etag}"',
+            'Last-Modified': http_date(newest.st_mtime),
+            'Accept-Ranges': 'bytes',
+            'Content-Disposition': f"attachment; filename=\"{zip_name.encode('ascii', 'replace').decode()}\"; "
+                                   f"filename*=UTF-8''{quote(zip_name)}",
+        }
+        
+        if not_modified(etag, newest):
+            archive.close()
+            return Response(status=304, headers=headers)
+        
+        ranges = None
+        if 'Range' in request.headers and range_applies(etag, newest):
+            ranges = parse_byte_ranges(request.headers['Range'], archive.size)
+        if ranges == []:
+            archive.close()
+            headers['Content-Range'] = f"bytes */{archive.size}"
+            return Response(status=416, headers=headers)
+        
+        for m in archive.members:
+            library_touch(Path(m.f.name))
+        
+        # Resuming clients ask for one range; anything fancier gets the whole archive
+        start, length, status = 0, archive.size, 200
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            length, status = end - start + 1, 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{archive.size}"
+        headers['Content-Length'] = str(length)
+        SERVED_BYTES.labels(request.url_rule.rule).inc(length)
+        return Response(archive.chunks(start, length), status=status, headers=headers,
+                        mimetype='application/zip', direct_passthrough=True)
+    
+    except Exception as e:
+        print(f"Error zipping album: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/thumb/<item_id>', methods=['GET'])
+def thumbnail(item_id):
+    """Resized artwork of a video or album, cached on disk and by clients"""
+    try:
+        if not VIDEO_ID_RE.match(item_id):
+            return jsonify({'error': 'Invalid ID'}), 400
+        try:
+            requested = int(request.args.get('size', THUMB_DEFAULT_SIZE))
+        except ValueError:
+            return jsonify({'error': 'size must be an integer'}), 400
+        size = next((s for s in THUMB_SIZES if s >= requested), THUMB_SIZES[-1])
+        
+        image_format = request.args.get('format')
+        if image_format is None:
+            image_format = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+        if image_format not in THUMB_FORMATS:
+            return jsonify({'error': f"Unknown format: {image_format}"}), 400
+        
+        url = artwork_source(item_id)
+        if url is None:
+            return jsonify({'error': 'No artwork known for this ID'}), 404
+        try:
+            original = fetch_artwork(url)
+        except Exception as e:
+            return jsonify({'error': f"Could not fetch artwork: {e}"}), 502
+        variant = thumbnail_variant(original, size, image_format)
+        
+        ext, mimetype, _ = THUMB_FORMATS[image_format]
+        response = serve_file(variant, f"{item_id}-{size}.{ext}", mimetype)
+        response.headers['Content-Disposition'] = f'inline; filename="{item_id}-{size}.{ext}"'
+        response.headers['Cache-Control'] = f"public, max-age={THUMB_CACHE_SECONDS}"
+        if 'format' not in request.args:
+            response.headers['Vary'] = 'Accept'
+        return response
+    
+    except Exception as e:
+        print(f"Error serving thumbnail: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def resolve_album(playlist_id):
+    """Title, thumbnail and track count of an album playlist, or None"""
+    # Each lookup checks out its own YoutubeDL: instances are not thread-safe
+    playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
+    print(f"Extracting playlist: {playlist_url}")
+    with scheduled('interactive'), pooled_ydl('flat') as ydl, timed('album_lookup'):
+        playlist_info = ydl.extract_info(playlist_url, download=False)
+    
+    if not playlist_info:
+        return None
+    
+    title = playlist_info.get('title', '')
+    uploader = playlist_info.get('uploader', '') or playlist_info.get('channel', '')
+    
+    # Get thumbnail
+    thumbnail = ''
+    if 'thumbnail' in playlist_info:
+        thumbnail = playlist_info['thumbnail']
+    elif 'thumbnails' in playlist_info and len(playlist_info['thumbnails']) > 0:
+        thumbnail = playlist_info['thumbnails'][-1].get('url', '')
+    
+    # Get accurate track count from entries
+    track_count = len(playlist_info.get('entries', []))
+    
+    if not title or track_count == 0:
+        return None
+    
+    print(f"Found official album: {title} ({track_count} tracks)")
+    remember_artwork_source(playlist_id, thumbnail)
+    return {
+        'id': playlist_id,
+        'title': title,
+        'thumbnail': thumbnail,
+        'thumb_url': f"/thumb/{playlist_id}",
+        'author': uploader,
+        'track_count': track_count,
+    }
+
+def resolve_albums(playlist_ids, deadline, limit=None):
+    """Resolve playlists concurrently, keeping the order of playlist_ids.
+
+    Stops waiting at `deadline` (a time.monotonic() value) or as soon as the
+    first `limit` albums in order are known. Returns (albums, complete).
+    """
+    if not playlist_ids:
+        return [], True
+    
+    executor = ThreadPoolExecutor(max_workers=min(ALBUM_LOOKUP_CONCURRENCY, len(playlist_ids)),
+                                  thread_name_prefix='album-lookup')
+    futures = [executor.submit(resolve_album, playlist_id) for playlist_id in playlist_ids]
+    
+    def ordered_results():
+        albums = []
+        for playlist_id, future in zip(playlist_ids, futures):
+            if not future.done():
+                return albums, False
+            if future.exception() is None and future.result():
+                albums.append(future.result())
+                if limit and len(albums) >= limit:
+                    return albums, True
+        return albums, True
+    
+    try:
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if ordered_results()[1]:
+                break
+    finally:
+        # Lookups still running past the deadline finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    for playlist_id, future in zip(playlist_ids, futures):
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            print(f"Error extracting playlist {playlist_id}: {future.exception()}")
+    
+    albums, complete = ordered_results()
+    if not complete:
+        # Keep whatever finished in time, still in the serial order
+        albums = [future.result() for future in futures
+                  if future.done() and not future.cancelled()
+                  and future.exception() is None and future.result()]
+        if limit:
+            albums = albums[:limit]
+        print(f"Album lookup deadline reached, returning {len(albums)} partial results")
+    return albums, complete
+
 @app.route('/search_albums', methods=['POST'])
 def search_albums():
     """Search YouTube albums/playlists (official only)"""
@@ -155,25 +2455,28 @@ def search_albums():
         if not query:
             return jsonify({'error': 'Query is required'}), 400
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-        }
+        cache_key = normalize_query(query)
+        cached_albums = result_cache_get('search_albums', cache_key)
+        if cached_albums is not None:
+            response = jsonify({'results': cached_albums, 'partial': False})  # Only complete results are cached
+            response.headers['X-Cache'] = 'HIT'
+            return response
         
+        deadline = time.monotonic() + ALBUM_LOOKUP_DEADLINE
         albums = []
+        complete = True
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with pooled_ydl('flat') as ydl:
             # Search for the artist's channel
             try:
                 # First, find the artist's channel
                 channel_query = f"ytsearch1:{query} official"
                 print(f"Searching for channel: {channel_query}")
-                search_results = ydl.extract_info(channel_query, download=False)
+                with scheduled('interactive'), timed('channel_search'):
+                    search_results = ydl.extract_info(channel_query, download=False)
                 
                 channel_url = None
-                if search_results and 'entries' in search_results:
+                if search_results and search_results.get('entries'):
                     first_result = search_results['entries'][0]
                     if first_result:
                         # Get channel URL from the video
@@ -186,52 +2489,18 @@ def search_albums():
                 if channel_url:
                     try:
                         print(f"Extracting releases from: {channel_url}")
-                        channel_info = ydl.extract_info(channel_url, download=False)
+                        with scheduled('interactive'), timed('channel_releases'):
+                            channel_info = ydl.extract_info(channel_url, download=False)
                         
                         if channel_info and 'entries' in channel_info:
-                            for item in channel_info['entries'][:10]:  # Limit to 10 albums
-                                if not item:
-                                    continue
-                                
-                                # Check if it's a playlist (album)
-                                item_id = item.get('id', '')
-                                
-                                # Official albums have OLAK5uy_ in their playlist ID
-                                if item_id and 'OLAK5uy_' in item_id:
-                                    try:
-                                        # Extract full playlist info to get track count
-                                        playlist_url = f"https://www.youtube.com/playlist?list={item_id}"
-                                        print(f"Extracting playlist: {playlist_url}")
-                                        
-                                        playlist_info = ydl.extract_info(playlist_url, download=False)
-                                        
-                                        if playlist_info:
-                                            title = playlist_info.get('title', '')
-                                            uploader = playlist_info.get('uploader', '') or playlist_info.get('channel', '')
-                                            
-                                            # Get thumbnail
-                                            thumbnail = ''
-                                            if 'thumbnail' in playlist_info:
-                                                thumbnail = playlist_info['thumbnail']
-                                            elif 'thumbnails' in playlist_info and len(playlist_info['thumbnails']) > 0:
-                                                thumbnail = playlist_info['thumbnails'][-1].get('url', '')
-                                            
-                                            # Get accurate track count from entries
-                                            track_count = len(playlist_info.get('entries', []))
-                                            
-                                            if title and track_count > 0:
-                                                print(f"Found official album: {title} ({track_count} tracks)")
-                                                albums.append({
-                                                    'id': item_id,
-                                                    'title': title,
-                                                    'thumbnail': thumbnail,
-                                                    'author': uploader,
-                                                    'track_count': track_count,
-                                                })
-                                    except Exception as e:
-                                        print(f"Error extracting playlist {item_id}: {e}")
-                                        continue
-
+                            # Official albums have OLAK5uy_ in their playlist ID
+                            playlist_ids = [
+                                item.get('id', '')
+                                for item in channel_info['entries'][:10]  # Limit to 10 albums
+                                if item and 'OLAK5uy_' in item.get('id', '')
+                            ]
+                            albums, complete = resolve_albums(playlist_ids, deadline)
+                    
                     except Exception as e:
                         print(f"Error extracting channel releases: {e}")
                         import traceback
@@ -242,68 +2511,42 @@ def search_albums():
                 traceback.print_exc()
             
             # Fallback: Search for official album playlists directly
-            if len(albums) == 0:
+            if len(albums) == 0 and time.monotonic() >= deadline:
+                complete = False  # Out of time before the fallback: "no albums" is not known
+            elif len(albums) == 0:
                 try:
                     # Search for playlists with OLAK identifier (official albums)
                     album_query = f"ytsearch10:{query} OLAK5uy"
                     print(f"Fallback search: {album_query}")
-                    search_results = ydl.extract_info(album_query, download=False)
+                    with scheduled('interactive'), timed('album_search'):
+                        search_results = ydl.extract_info(album_query, download=False)
                     
+                    playlist_ids = []
                     if search_results and 'entries' in search_results:
                         for entry in search_results.get('entries', []):
                             if not entry:
                                 continue
                             
-                            # Check if URL contains playlist
-                            url = entry.get('url', '')
+                            # Extract playlist ID from URL
                             webpage_url = entry.get('webpage_url', '')
-                            
-                            if 'OLAK5uy_' in url or 'OLAK5uy_' in webpage_url or 'list=' in webpage_url:
-                                # Extract playlist ID from URL
-                                playlist_id = None
-                                if 'list=' in webpage_url:
-                                    playlist_id = webpage_url.split('list=')[1].split('&')[0]
-                                
-                                if playlist_id and 'OLAK5uy_' in playlist_id:
-                                    try:
-                                        playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
-                                        playlist_info = ydl.extract_info(playlist_url, download=False)
-                                        
-                                        if playlist_info:
-                                            title = playlist_info.get('title', '')
-                                            uploader = playlist_info.get('uploader', '') or playlist_info.get('channel', '')
-                                            
-                                            # Get thumbnail
-                                            thumbnail = ''
-                                            if 'thumbnail' in playlist_info:
-                                                thumbnail = playlist_info['thumbnail']
-                                            elif 'thumbnails' in playlist_info and len(playlist_info['thumbnails']) > 0:
-                                                thumbnail = playlist_info['thumbnails'][-1].get('url', '')
-                                            
-                                            track_count = len(playlist_info.get('entries', []))
-                                            
-                                            if title and track_count > 0:
-                                                print(f"Found official album (fallback): {title} ({track_count} tracks)")
-                                                albums.append({
-                                                    'id': playlist_id,
-                                                    'title': title,
-                                                    'thumbnail': thumbnail,
-                                                    'author': uploader,
-                                                    'track_count': track_count,
-                                                })
-                                                
-                                                if len(albums) >= 5:
-                                                    break
-                                    except Exception as e:
-                                        print(f"Error extracting playlist: {e}")
-                                        continue
+                            if 'list=' in webpage_url:
+                                playlist_id = webpage_url.split('list=')[1].split('&')[0]
+                                if 'OLAK5uy_' in playlist_id and playlist_id not in playlist_ids:
+                                    playlist_ids.append(playlist_id)
+                    
+                    albums, complete = resolve_albums(playlist_ids, deadline, limit=5)
                 except Exception as e:
                     print(f"Error in fallback search: {e}")
                     import traceback
                     traceback.print_exc()
             
             print(f"Returning {len(albums)} albums")
-            return jsonify({'results': albums})
+            # Partial results (deadline hit) are returned but not cached
+            if albums and complete:
+                result_cache_put('search_albums', cache_key, albums)
+            response = jsonify({'results': albums, 'partial': not complete})
+            response.headers['X-Cache'] = 'MISS'
+            return response
     
     except Exception as e:
         print(f"Error in search_albums: {e}")
@@ -322,127 +2565,239 @@ def get_album_tracks():
         if not playlist_id:
             return jsonify({'error': 'Playlist ID is required'}), 400
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
-            playlist_info = ydl.extract_info(playlist_url, download=False)
-            
-            tracks = []
-            for entry in playlist_info.get('entries', []):
-                if entry:
-                    tracks.append({
-                        'id': entry.get('id', ''),
-                        'title': entry.get('title', ''),
-                        'url': entry.get('url', f"https://www.youtube.com/watch?v={entry.get('id', '')}"),
-                        'thumbnail': entry.get('thumbnail', ''),
-                        'duration': entry.get('duration', 0),
-                        'author': entry.get('uploader', ''),
-                    })
-            
-            return jsonify({'tracks': tracks})
+        tracks, hit = load_album_tracks(playlist_id)
+        response = jsonify({'tracks': tracks})
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/download_album', methods=['POST'])
 def download_album():
-    """Download entire album into a dedicated folder"""
+    """Start a background job that downloads an album into a dedicated folder"""
     try:
         data = request.json
         playlist_id = data.get('playlist_id', '')
         album_title = data.get('album_title', 'Album')
+        profile = data.get('profile', DEFAULT_PROFILE)
         
         if not playlist_id:
             return jsonify({'error': 'Playlist ID is required'}), 400
+        if profile not in PROFILES:
+            return jsonify({'error': f"Unknown profile: {profile}"}), 400
         
         # Sanitize album name for folder
-        safe_album_name = "".join(c for c in album_title if c.isalnum() or c in (' ', '-', '_')).strip()
+        safe_album_name = safe_filename(album_title) or 'Album'
         album_folder = DOWNLOAD_DIR / safe_album_name
         album_folder.mkdir(exist_ok=True)
         
-        # Get playlist tracks
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+        job = {
+            'id': uuid.uuid4().hex,
+            'playlist_id': playlist_id,
+            'album_title': album_title,
+            'album_folder': safe_album_name,
+            'profile': profile,
+            'client': client_id(),  # Album tracks queue fairly per client
+            'status': 'resolving',
+            'created_at': time.time(),
+            'total_tracks': 0,
+            'completed': 0,
+            'failed': 0,
+            'tracks': [],
+            'downloaded_files': [],
         }
+        write_job(job)
+        album_executor.submit(run_album_job, job['id'])
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
-            playlist_info = ydl.extract_info(playlist_url, download=False)
-            
-            downloaded_files = []
-            total_tracks = len(playlist_info.get('entries', []))
-            
-            # Download each track
-            for idx, entry in enumerate(playlist_info.get('entries', []), 1):
-                if entry:
-                    video_id = entry.get('id', '')
-                    title = entry.get('title', f'Track {idx}')
-                    safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-                    
-                    output_path = album_folder / f"{safe_title}.mp3"
-                    
-                    # Download options with metadata and artwork
-                    download_opts = {
-                        'format': 'bestaudio/best',
-                        'postprocessors': [
-                            {
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': '320',
-                            },
-                            {
-                                'key': 'FFmpegMetadata',
-                                'add_metadata': True,
-                            },
-                            {
-                                'key': 'EmbedThumbnail',
-                                'already_have_thumbnail': False,
-                            }
-                        ],
-                        'writethumbnail': True,  # Download thumbnail
-                        'outtmpl': str(album_folder / f"{safe_title}.%(ext)s"),
-                        'quiet': False,
-                        'no_warnings': False,
-                        'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-                    }
-                    
-                    try:
-                        with yt_dlp.YoutubeDL(download_opts) as download_ydl:
-                            download_ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
-                        
-                        if output_path.exists():
-                            downloaded_files.append({
-                                'title': title,
-                                'file_path': f"{safe_album_name}/{safe_title}.mp3",
-                                'progress': f"{idx}/{total_tracks}"
-                            })
-                    except Exception as e:
-                        print(f"Error downloading {title}: {e}")
-                        continue
-            
-            return jsonify({
-                'success': True,
-                'album_folder': safe_album_name,
-                'downloaded_files': downloaded_files,
-                'total_tracks': total_tracks
-            })
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status_url': f"/jobs/{job['id']}",
+            'album_folder': safe_album_name,
+            'zip_url': f"/album_zip/{quote(safe_album_name)}",
+        }), 202
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the state of an album job and each of its tracks"""
+    if not JOB_ID_RE.match(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """SSE stream of per-track progress for an album job"""
+    job = read_job(job_id) if JOB_ID_RE.match(job_id) else None
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    resume_from = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if job['status'] in ('done', 'error') and not resume_from:
+        finished = json.dumps({'type': f"job_{job['status']}", 'status': job['status'],
+                               'total_tracks': job['total_tracks'], 'completed': job['completed'],
+                               'failed': job['failed'], 'error': job.get('error')})
+        return sse_response(iter([f"event: job_{job['status']}\ndata: {finished}\n\n"]))
+    # A retried job keeps its log: replay only the current run
+    return sse_follow(f"job-{job_id}", resume_from, terminal=('job_done', 'job_error'), skip_finished=True)
+
+@app.route('/tracks/<video_id>/events', methods=['GET'])
+def track_events(video_id):
+    """SSE stream of download progress for one track (subscribe, then POST /download)"""
+    profile = request.args.get('profile', DEFAULT_PROFILE)
+    if not VIDEO_ID_RE.match(video_id):
+        return jsonify({'error': 'Invalid video ID'}), 400
+    if profile not in PROFILES:
+        return jsonify({'error': f"Unknown profile: {profile}"}), 400
+    
+    resume_from = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    output_path = DOWNLOAD_DIR / cached_track_name(video_id, profile)
+    if output_path.exists() and not resume_from:
+        done = json.dumps({'type': 'done', 'video_id': video_id, 'file_path': output_path.name,
+                           'file_size': output_path.stat().st_size, 'cached': True})
+        return sse_response(iter([f"event: done\ndata: {done}\n\n"]))
+    return sse_follow(track_channel(video_id, profile), resume_from,
+                      terminal=('done', 'failed'), skip_finished=True)
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """Queue failed tracks again (and tracks orphaned by a dead worker)"""
+    try:
+        if not JOB_ID_RE.match(job_id) or read_job(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        retried = []
+        
+        def requeue(job):
+            for track in job['tracks']:
+                orphaned = (track['state'] in ('pending', 'downloading')
+                            and not worker_alive(track['worker_pid']))
+                if track['state'] == 'failed' or orphaned:
+                    track['state'] = 'pending'
+                    track['worker_pid'] = os.getpid()
+                    retried.append(track['index'])
+        
+        job = update_job(job_id, requeue)
+        for index in retried:
+            album_executor.submit(run_album_track, job_id, index)
+        
+        return jsonify({'success': True, 'retried': retried, 'job': job})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/library', methods=['GET'])
+def list_library():
+    """Paginated listing of downloaded files, filterable by id, profile and title"""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), LIBRARY_MAX_PER_PAGE)
+        sort = request.args.get('sort', 'created')
+        order_by = {
+            'created': 'created_at DESC',
+            'accessed': 'last_accessed IS NULL, last_accessed DESC',
+            'size': 'size DESC',
+            'title': 'title COLLATE NOCASE',
+        }.get(sort)
+        if order_by is None:
+            return jsonify({'error': f"Unknown sort: {sort}"}), 400
+        
+        conditions = []
+        params = []
+        for field in ('video_id', 'playlist_id', 'profile'):
+            if request.args.get(field):
+                conditions.append(f"{field} = ?")
+                params.append(request.args[field])
+        if request.args.get('q'):
+            conditions.append('title LIKE ?')
+            params.append(f"%{request.args['q']}%")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        conn = open_db(LIBRARY_DB, LIBRARY_SCHEMA)
+        total = conn.execute(f'SELECT COUNT(*) FROM tracks {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(LIBRARY_COLUMNS)} FROM tracks {where}"
+            f" ORDER BY {order_by}, path LIMIT ? OFFSET ?",
+            params + [per_page, (page - 1) * per_page]).fetchall()
+        
+        items = []
+        for row in rows:
+            item = dict(zip(LIBRARY_COLUMNS, row))
+            item['file_path'] = item.pop('path')
+            del item['mtime_ns']
+            items.append(item)
+        
+        return jsonify({'items': items, 'page': page, 'per_page': per_page, 'total': total})
+    
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """Output profiles accepted by /download, /download_album and /stream"""
+    return jsonify({
+        'default': DEFAULT_PROFILE,
+        'profiles': [
+            {
+                'name': name,
+                'ext': settings['ext'],
+                'bitrate': settings['quality'],
+                'reencode': settings['quality'] is not None,
+                'streamable': settings['stream_args'] is not None,
+            }
+            for name, settings in PROFILES.items()
+        ],
+    })
+
+@app.route('/storage', methods=['GET'])
+def storage_usage():
+    """Disk usage of the downloads directory against the quota"""
+    try:
+        groups = disk_usage()
+        return jsonify({
+            'usage_bytes': sum(group['size'] for group in groups),
+            'files': len(groups),
+            'quota_bytes': DISK_QUOTA_BYTES or None,
+            'low_watermark_bytes': int(DISK_QUOTA_BYTES * DISK_QUOTA_LOW_WATERMARK) or None,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_stats():
+    """Slots, queue depth per priority and client, wait times and throttling backoff (this worker)"""
+    return jsonify(scheduler.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and entry counts of the shared result cache"""
+    try:
+        return jsonify({'results': result_cache_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, aggregated over all gunicorn workers"""
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(ResultCacheCollector())
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'message': 'Server is running'})
+    return jsonify({'status': 'ok', 'message': 'Server is running', 'ydl_pools': ydl_pool_stats()})
 
 if __name__ == '__main__':
     print("YouTube Download Server Starting...")
@@ -450,4 +2805,5 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     print(f"Server running on http://0.0.0.0:{port}")
     print("Use your PC's IP address to connect from Flutter app")
+    warm_ydl_pools()
     app.run(host='0.0.0.0', port=port, debug=False)
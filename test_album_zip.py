@@ -0,0 +1,77 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+TRACKS = {
+    '01 - Intro.mp3': os.urandom(1000),
+    '02 - Canción.mp3': os.urandom(300_000),  # Spans several CHUNK_SIZE reads
+    '03 - Empty.mp3': b'',
+}
+
+
+@pytest.fixture
+def album(server, tmp_path):
+    for name, data in TRACKS.items():
+        (tmp_path / name).write_bytes(data)
+
+    def build():
+        """A fresh archive over newly opened files, with no CRCs remembered"""
+        server._crc_cache.clear()
+        return server.AlbumZip('Album', [(name, open(tmp_path / name, 'rb')) for name in sorted(TRACKS)])
+    return build
+
+
+def test_full_archive_is_valid(album):
+    archive = album()
+    data = b''.join(archive.chunks(0, archive.size))
+    assert len(data) == archive.size
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        assert sorted(z.namelist()) == [f"Album/{name}" for name in sorted(TRACKS)]
+        for name, content in TRACKS.items():
+            assert z.read(f"Album/{name}") == content
+
+
+def test_ranges_match_the_full_archive(album):
+    archive = album()
+    full = b''.join(archive.chunks(0, archive.size))
+    second = archive_member(album(), '02 - Canción.mp3')
+    boundaries = [
+        (0, 10),                                             # First local header
+        (second.data_offset - 5, 10),                        # Header into data
+        (second.data_offset + 70_000, 100_000),              # Middle of a file
+        (second.data_offset + second.size - 3, 20),          # Data into the descriptor (CRC)
+        (archive.central_offset - 8, 40),                    # Descriptor into the central directory
+        (archive.size - 30, 30),                             # End record
+        (12_345, archive.size - 12_345),                     # Resume to the end
+    ]
+    for start, length in boundaries:
+        # Every resume starts from a new archive, as a new request would
+        assert b''.join(album().chunks(start, length)) == full[start:start + length], (start, length)
+
+
+def archive_member(archive, name):
+    member = next(m for m in archive.members if m.name.decode().endswith(name))
+    archive.close()
+    return member
+
+
+def test_route_resumes_and_rejects_the_downloads_root(server):
+    folder = server.DOWNLOAD_DIR / 'Test Album'
+    folder.mkdir(exist_ok=True)
+    for name, data in TRACKS.items():
+        (folder / name).write_bytes(data)
+    client = server.app.test_client()
+
+    full = client.get('/album_zip/Test Album')
+    assert full.status_code == 200
+    partial = client.get('/album_zip/Test Album', headers={'Range': 'bytes=1000-'})
+    assert partial.status_code == 206
+    assert partial.data == full.data[1000:]
+    stale = client.get('/album_zip/Test Album', headers={'Range': 'bytes=1000-', 'If-Range': '"other"'})
+    assert stale.status_code == 200
+
+    assert client.get('/album_zip/.').status_code == 404
+    assert client.get('/album_zip/Test Album/..').status_code == 404
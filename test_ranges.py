@@ -0,0 +1,30 @@
+def test_single_range(server):
+    assert server.parse_byte_ranges('bytes=0-99', 1000) == [(0, 99)]
+    assert server.parse_byte_ranges('bytes=500-', 1000) == [(500, 999)]
+    assert server.parse_byte_ranges('bytes=900-5000', 1000) == [(900, 999)]
+
+
+def test_suffix_range(server):
+    assert server.parse_byte_ranges('bytes=-100', 1000) == [(900, 999)]
+    assert server.parse_byte_ranges('bytes=-5000', 1000) == [(0, 999)]
+    assert server.parse_byte_ranges('bytes=-0', 1000) == []
+
+
+def test_multi_range(server):
+    assert server.parse_byte_ranges('bytes=0-9, 20-29,-5', 100) == [(0, 9), (20, 29), (95, 99)]
+    # Unsatisfiable parts are dropped as long as one part remains
+    assert server.parse_byte_ranges('bytes=0-9,500-600', 100) == [(0, 9)]
+
+
+def test_unsatisfiable(server):
+    assert server.parse_byte_ranges('bytes=1000-', 1000) == []
+    assert server.parse_byte_ranges('bytes=1000-2000,3000-', 1000) == []
+    assert server.parse_byte_ranges('bytes=0-', 0) == []
+
+
+def test_malformed_is_ignored(server):
+    for header in ('bytes', 'bytes=', 'items=0-9', 'bytes=abc', 'bytes=-', 'bytes=9-0',
+                   'bytes=1-2-3', 'bytes=0x10-20', 'bytes=0-9,,20-29'):
+        assert server.parse_byte_ranges(header, 1000) is None, header
+    too_many = 'bytes=' + ','.join(f"{i}-{i}" for i in range(server.MAX_RANGES + 1))
+    assert server.parse_byte_ranges(too_many, 1000) is None
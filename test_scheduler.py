@@ -0,0 +1,111 @@
+import threading
+import time
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def start_acquire(scheduler, priority, client, order=None):
+    """Acquire in a background thread; returns an Event set once granted"""
+    granted = threading.Event()
+
+    def run():
+        ticket = scheduler.acquire(priority, client)
+        if order is not None:
+            order.append(client)
+        granted.set()
+        scheduler.release(ticket)
+    threading.Thread(target=run, daemon=True).start()
+    return granted
+
+
+def queued(scheduler, priority):
+    return scheduler.stats()['queued'][priority]
+
+
+def test_bulk_waiter_resumes_after_backoff(server, monkeypatch):
+    monkeypatch.setattr(server, 'SCHEDULER_BACKOFF_BASE', 0.3)
+    scheduler = server.Scheduler(2, 0)
+    running = [scheduler.acquire('bulk', 'a'), scheduler.acquire('bulk', 'a')]
+    granted = start_acquire(scheduler, 'bulk', 'a')
+    wait_for(lambda: queued(scheduler, 'bulk') == 1)
+
+    # The waiter went to sleep before the pause; the releases during it grant nothing
+    scheduler.throttled()
+    for ticket in running:
+        scheduler.release(ticket)
+    assert not granted.wait(0.1)
+    assert granted.wait(3)
+
+
+def test_interactive_waiters_go_first(server):
+    scheduler = server.Scheduler(1, 0)
+    running = scheduler.acquire('bulk', 'a')
+    order = []
+    start_acquire(scheduler, 'bulk', 'b', order)
+    wait_for(lambda: queued(scheduler, 'bulk') == 1)
+    start_acquire(scheduler, 'interactive', 'ui', order)
+    wait_for(lambda: queued(scheduler, 'interactive') == 1)
+
+    scheduler.release(running)
+    wait_for(lambda: len(order) == 2)
+    assert order == ['ui', 'b']
+
+
+def test_bulk_clients_take_turns(server):
+    scheduler = server.Scheduler(1, 0)
+    running = scheduler.acquire('bulk', 'x')
+    order = []
+    for n, client in enumerate(('a', 'a', 'a', 'b'), 1):
+        start_acquire(scheduler, 'bulk', client, order)
+        wait_for(lambda: queued(scheduler, 'bulk') == n)  # Queue in a known order
+
+    scheduler.release(running)
+    wait_for(lambda: len(order) == 4)
+    assert order[:2] == ['a', 'b']
+
+
+def test_coalesced_fetches_hold_no_slot(server, monkeypatch):
+    """Callers waiting for a track someone else is downloading leave the slots to other work"""
+    scheduler = server.Scheduler(4, 1)
+    monkeypatch.setattr(server, 'scheduler', scheduler)
+    started = threading.Event()
+    finish = threading.Event()
+
+    class SlowYDL:
+        def __init__(self, outtmpl):
+            self.outtmpl = outtmpl
+
+        def extract_info(self, url, download=True):
+            started.set()
+            finish.wait(5)
+            with open(self.outtmpl.replace('%(ext)s', 'mp3'), 'wb') as f:
+                f.write(b'audio')
+            return {'title': 'Hot', 'duration': 1}
+
+    @server.contextmanager
+    def slow_ydl(kind, outtmpl=None):
+        yield SlowYDL(outtmpl)
+    monkeypatch.setattr(server, 'pooled_ydl', slow_ydl)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(server.fetch_track('hotvideo123', 'mp3-320')),
+                                daemon=True)
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+    try:
+        assert started.wait(5)
+        time.sleep(0.2)  # Let the other callers find the track in flight
+        assert scheduler.stats()['running']['interactive'] == 1
+        # A /search still gets a slot at once
+        assert start_acquire(scheduler, 'interactive', 'search').wait(1)
+    finally:
+        finish.set()
+    for t in threads:
+        t.join(5)
+    assert sorted(cached for _, cached in results) == [False] + [True] * 5